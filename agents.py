@@ -1,22 +1,345 @@
 from __future__ import annotations
 
 import os
-import uuid
-import json
+import re
+import time
+import hashlib
+import orjson
 import asyncio 
-from openai import OpenAI
+import inspect
+import functools
+import httpx
+import asyncpg
+from collections import OrderedDict
+from types import MappingProxyType, SimpleNamespace
+from openai import AsyncOpenAI
 from supabase import Client
-from typing import Any, Dict, Optional, Union, List
+from typing import Any, AsyncIterator, Dict, Optional, Union, List
+
+try:
+    import redis.asyncio as aioredis  # optional: only needed when REDIS_URL is set
+except ImportError:
+    aioredis = None
 
 
 from prompts import FLASHCARD_CHUNKER, FLASHCARD_GENERATOR, FLASHCARD_QA, CONTENT_INSTRUCTIONS
 # from pydantic_formatting import ChunkPayload, CardsPayload, QAReviewPayload, coerce_and_validate
 
 
+# Streamed responses are yielded in batches of this many characters or seconds, whichever comes first
+STREAM_FLUSH_CHARS    = 8192
+STREAM_FLUSH_INTERVAL = 0.025
+
+# Upper bound on concurrent OpenAI requests when fanning out per-chunk calls
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+
+
+# -------- contextualized message templates --------
+
+_LINE_SPACER = '-' * 60
+
+_ACADEMIC_CONTEXT_TMPL = (
+    'The following is the students Lifestyle & Health Questionaire:\n\n\n{lifestyle_priorities}. \n\n\n'
+    ' The following is the students Social & Academic Questionaire:\n\n\n {social_priorities}.\n\n\n'
+    ' The following is the students academic profile: \n\n\n {student_details} \n\n\n{line_spacer}\n\n\n'
+    ' The following is the retrieved episodic memory: \n\n {episodic_memory}'
+)
+
+_JOBS_CONTEXT_TMPL = (
+    _ACADEMIC_CONTEXT_TMPL
+    + ' \n\n\n The following is the extracted skills from a multiple of job opportunities {message}'
+)
+
+
+# -------- openai client --------
+
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+
+_OPENAI_CLIENTS: Dict[str, AsyncOpenAI] = {}
+
+
+def get_openai_client(api_key: str) -> AsyncOpenAI:
+    """
+    One pooled AsyncOpenAI client per API key, shared by every agent in the process so
+    warm invocations reuse keep-alive connections instead of paying a TLS handshake each time.
+    The pool binds to the event loop that first uses it, so drive agents from one long-lived loop.
+    """
+    client = _OPENAI_CLIENTS.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=2,
+            timeout=OPENAI_TIMEOUT,
+            http_client=httpx.AsyncClient(
+                timeout=OPENAI_TIMEOUT,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            ),
+        )
+        _OPENAI_CLIENTS[api_key] = client
+    return client
+
+
+# -------- llm response cache --------
+
+# Content-addressed cache for deterministic (model, instructions, input) calls.
+# Disabled unless REDIS_URL is set (and redis is installed).
+REDIS_URL     = os.getenv("REDIS_URL")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+
+_REDIS = aioredis.from_url(REDIS_URL) if (REDIS_URL and aioredis is not None) else None
+
+
+@functools.lru_cache(maxsize=32)
+def _prefix_digest(model: str, instructions: str) -> "hashlib._Hash":
+    """sha256 state already fed the static (model, instructions) prefix -- the multi-KB prompts are encoded and hashed once."""
+    digest = hashlib.sha256()
+    for part in (model, instructions):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest
+
+
+def _llm_cache_key(params: Dict[str, Any]) -> str:
+    digest = _prefix_digest(str(params["model"]), str(params["instructions"])).copy()
+    digest.update(str(params["input"]).encode("utf-8"))
+    digest.update(b"\x00")
+    return "llm:" + digest.hexdigest()
+
+
+async def _cached_responses_create(client: AsyncOpenAI, **params) -> Any:
+    """
+    client.responses.create(**params) behind the Redis cache. Cache hits return a
+    lightweight stand-in exposing .output_text and .usage.{input,output}_tokens,
+    which is all the agents read from a response.
+    """
+    if _REDIS is None:
+        return await client.responses.create(**params)
+
+    key = _llm_cache_key(params)
+    try:
+        cached = await _REDIS.get(key)
+    except Exception as e:
+        print(f"LLM cache read failed: {e}")
+        cached = None
+
+    if cached is not None:
+        hit = orjson.loads(cached)
+        return SimpleNamespace(
+            output_text=hit["output_text"],
+            usage=SimpleNamespace(input_tokens=hit["input_tokens"], output_tokens=hit["output_tokens"]),
+        )
+
+    resp = await client.responses.create(**params)
+
+    output_text = getattr(resp, "output_text", None)
+    if isinstance(output_text, str) and output_text:
+        try:
+            await _REDIS.set(key, orjson.dumps({
+                "output_text": output_text,
+                "input_tokens": resp.usage.input_tokens,
+                "output_tokens": resp.usage.output_tokens,
+            }), ex=LLM_CACHE_TTL)
+        except Exception as e:
+            print(f"LLM cache write failed: {e}")
+
+    return resp
+
+
+# -------- postgres pool --------
+
+# Direct Postgres DSN for hot-path reads/writes, e.g. the Supabase pooler:
+#   postgresql://postgres.<project-ref>:<password>@aws-0-<region>.pooler.supabase.com:6543/postgres
+# When unset, agents fall back to the supabase-py (PostgREST) client passed into run().
+SUPABASE_DB_DSN = os.getenv("SUPABASE_DB_DSN")
+
+_POOL_TASK: Optional["asyncio.Task[asyncpg.Pool]"] = None
+_POOL_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _orjson_dumps_str(obj: Any) -> str:
+    return orjson.dumps(obj).decode()
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # Decode json/jsonb columns to Python objects once per connection
+    for typename in ("json", "jsonb"):
+        await conn.set_type_codec(typename, encoder=_orjson_dumps_str, decoder=orjson.loads, schema="pg_catalog")
+
+
+async def get_pool() -> Optional[asyncpg.Pool]:
+    """
+    Process-wide asyncpg pool, created lazily on the running event loop.
+    Returns None when SUPABASE_DB_DSN is not configured.
+    """
+    global _POOL_TASK, _POOL_LOOP
+
+    if not SUPABASE_DB_DSN:
+        return None
+
+    loop = asyncio.get_running_loop()
+    if _POOL_TASK is None or _POOL_LOOP is not loop:
+        _POOL_LOOP = loop
+        _POOL_TASK = loop.create_task(_create_pool())
+
+    task = _POOL_TASK
+    try:
+        return await task
+    except Exception:
+        # Don't pin a failed connect for the container's lifetime; the next call retries
+        if _POOL_TASK is task:
+            _POOL_TASK = None
+        raise
+
+
+async def _create_pool() -> asyncpg.Pool:
+    # create_pool returns an awaitable Pool, not a coroutine, so create_task needs this wrapper
+    return await asyncpg.create_pool(
+        dsn=SUPABASE_DB_DSN,
+        min_size=2,
+        max_size=20,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=0,  # pooler runs in transaction mode (no prepared statements)
+        init=_init_connection,
+    )
+
+
+# -------- supabase queries --------
+
+async def _execute(query: Any) -> Any:
+    """
+    Execute a supabase-py query builder from async code. AsyncClient builders are awaited
+    directly; the sync Client's blocking HTTP call is moved to a worker thread.
+    """
+    if inspect.iscoroutinefunction(query.execute):
+        return await query.execute()
+    return await asyncio.to_thread(query.execute)
+
+
+# -------- automated suggestion log writer --------
+
+# Log rows are queued by the agents and written in batches by a background task,
+# keeping the inserts off each run()'s critical path.
+LOG_TABLE          = 'automated_suggestions'
+LOG_BATCH_SIZE     = 100
+LOG_FLUSH_INTERVAL = 0.025  # seconds to wait for more rows before writing a batch
+
+_LOG_QUEUE: Optional[asyncio.Queue] = None
+_LOG_WRITER: Optional["asyncio.Task[None]"] = None
+
+
+def _log_queue() -> asyncio.Queue:
+    """Return the log queue for the running loop, starting its writer task on first use."""
+    global _LOG_QUEUE, _LOG_WRITER
+
+    loop = asyncio.get_running_loop()
+    if _LOG_WRITER is None or _LOG_WRITER.done() or _LOG_WRITER.get_loop() is not loop:
+        _LOG_QUEUE  = asyncio.Queue()
+        _LOG_WRITER = loop.create_task(_log_writer(_LOG_QUEUE))
+
+    return _LOG_QUEUE
+
+
+async def _log_writer(queue: asyncio.Queue) -> None:
+    while True:
+        batch = [await queue.get()]
+
+        # Give concurrent agents a moment to add rows to this batch
+        if queue.qsize() < LOG_BATCH_SIZE - 1:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        while len(batch) < LOG_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+
+        try:
+            await _write_log_batch(batch)
+        except Exception as e:
+            print(f"Error writing automated suggestions: {e}")
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+
+async def _write_log_batch(batch: List[tuple]) -> None:
+    """batch: [(supabase_client, row), ...] -> one multi-row insert per client (or one executemany)."""
+    pool = await get_pool()
+
+    if pool is not None:
+        await pool.executemany(
+            f"INSERT INTO {LOG_TABLE} (user_id, content, token_count, system_role_id) VALUES ($1, $2, $3, $4)",
+            [(row["user_id"], row["content"], row["token_count"], row["system_role_id"]) for _, row in batch],
+        )
+        return
+
+    # Supabase Client Multi-Row Insert (rows from different requests may carry different RLS clients)
+    by_client: Dict[int, tuple] = {}
+    for client, row in batch:
+        by_client.setdefault(id(client), (client, []))[1].append(row)
+
+    await asyncio.gather(*(
+        _execute(client.table(LOG_TABLE).insert(rows))
+        for client, rows in by_client.values()
+    ))
+
+
+async def flush_automated_suggestions() -> None:
+    """Wait until every queued automated-suggestion row has been written (call before the process freezes)."""
+    if _LOG_WRITER is None or _LOG_WRITER.done() or _LOG_WRITER.get_loop() is not asyncio.get_running_loop():
+        return
+    await _LOG_QUEUE.join()
+
+
+# -------- per-user read cache --------
+
+def async_ttl_cache(maxsize: int = 1024, ttl: float = 60.0):
+    """
+    LRU + TTL memoization for async methods, keyed by the call arguments (excluding self).
+    The wrapped method gains .bust(user_id) to drop every entry whose first argument
+    is user_id, and .cache_clear() to drop everything.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires_at, value)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments.values())[1:]
+
+            now = time.monotonic()
+            hit = entries.get(key)
+            if hit is not None and hit[0] > now:
+                entries.move_to_end(key)
+                return hit[1]
+
+            value = await fn(*args, **kwargs)
+            entries[key] = (now + ttl, value)
+            entries.move_to_end(key)
+            while len(entries) > maxsize:
+                entries.popitem(last=False)
+            return value
+
+        def bust(user_id: str) -> None:
+            for key in [k for k in entries if k and k[0] == user_id]:
+                del entries[key]
+
+        wrapper.bust        = bust
+        wrapper.cache_clear = entries.clear
+        return wrapper
+
+    return decorator
+
+
+def bust_user_cache(user_id: str) -> None:
+    """Invalidate cached school details / episodic memory for a user (e.g. after a Canvas sync)."""
+    OpenAIAgent.pull_school_details.bust(user_id)
+    OpenAIAgent.pull_episodic_memory.bust(user_id)
 
 
 class OpenAIAgent:
 
+    # JSON agents: return {} instead of the raw text when the response has no JSON
+    _JSON_ONLY = False
+
     '''
     Args:
         system_prompt:
@@ -35,7 +358,7 @@ class OpenAIAgent:
     ):
 
         self.agent_instructions  = self.get_system_prompt(system_prompt)
-        self.client              = OpenAI(api_key=api_key)
+        self.client              = get_openai_client(api_key)
         self.model               = model
         self.uuid                = uuid
         self.jwt_token           = jwt_token
@@ -49,26 +372,55 @@ class OpenAIAgent:
         return 
     
     
+    @async_ttl_cache(maxsize=1024, ttl=60)
     async def pull_school_details(self, user_id: str):
         table_name = 'canvas_ics_table'
-        student_courses = self.supabase_client.table(table_name) \
-                              .select('course_name') \
-                              .eq("user_id", user_id) \
-                              .order("created_at", desc=True) \
-                              .execute()
-        
+        pool       = await get_pool()
+
+        if pool is not None:
+            # Single Round-Trip: User Row Plus Ordered Course List
+            school_details = await pool.fetchrow(
+                f"""
+                SELECT u.canvas_institution_name,
+                       u.name,
+                       COALESCE(
+                           array_agg(c.course_name ORDER BY c.created_at DESC)
+                               FILTER (WHERE c.course_name IS NOT NULL),
+                           '{{}}'
+                       ) AS courses
+                FROM users u
+                LEFT JOIN {table_name} c ON c.user_id = u.user_id
+                WHERE u.user_id = $1
+                GROUP BY u.canvas_institution_name, u.name
+                """,
+                user_id,
+            )
 
-        institution_name = self.supabase_client.table('users') \
-                              .select('canvas_institution_name, name') \
-                              .eq("user_id", user_id) \
-                              .execute()
-        
+            institution = school_details['canvas_institution_name']
+            name        = school_details['name']
+            courses     = list(school_details['courses'])
 
-        institution = institution_name.data[0]['canvas_institution_name']
-        name        = institution_name.data[0]['name']
-        courses     = [course['course_name'] for course in student_courses.data]
+        else:
+            # Run Both Reads Concurrently
+            student_courses, institution_name = await asyncio.gather(
+                _execute(
+                    self.supabase_client.table(table_name) \
+                        .select('course_name') \
+                        .eq("user_id", user_id) \
+                        .order("created_at", desc=True)
+                ),
+                _execute(
+                    self.supabase_client.table('users') \
+                        .select('canvas_institution_name, name') \
+                        .eq("user_id", user_id)
+                ),
+            )
 
-        output = f"{name} is enrolled at {institution}.\Their current courses:\n"
+            institution = institution_name.data[0]['canvas_institution_name']
+            name        = institution_name.data[0]['name']
+            courses     = [course['course_name'] for course in student_courses.data]
+
+        output = f"{name} is enrolled at {institution}.\nTheir current courses:\n"
         for idx, course in enumerate(courses, start=1):
             output += f"  {idx}. {course}\n"
 
@@ -76,27 +428,39 @@ class OpenAIAgent:
 
         return output
     
+    @async_ttl_cache(maxsize=1024, ttl=60)
     async def pull_episodic_memory(self, user_id: str, system_role_id: int):
         table_name = 'agent_memory'
-        episodic_memory = self.supabase_client.table(table_name) \
-                        .select('conversation_id, summary') \
-                        .eq("user_id", user_id) \
-                        .eq("system_role_id", system_role_id)\
-                        .eq('memory_type', 'episodic') \
-                        .execute()
-        line_spacer      = '-' * 60
+        pool       = await get_pool()
+
+        if pool is not None:
+            episodic_memory = await pool.fetch(
+                f"SELECT conversation_id, summary FROM {table_name} "
+                "WHERE user_id = $1 AND system_role_id = $2 AND memory_type = 'episodic'",
+                user_id, system_role_id,
+            )
+        else:
+            episodic_memory = await _execute(
+                            self.supabase_client.table(table_name) \
+                                .select('conversation_id, summary') \
+                                .eq("user_id", user_id) \
+                                .eq("system_role_id", system_role_id)\
+                                .eq('memory_type', 'episodic')
+                        )
+            episodic_memory = episodic_memory.data
+
         formatted_string = ''
-        episodic_memory  = episodic_memory.data
 
         for memory in episodic_memory:
-            formatted_string += f'Conversation {memory["conversation_id"]}:\n Episodic Memories: {memory["summary"]}\n\n{line_spacer}\n'
+            formatted_string += f'Conversation {memory["conversation_id"]}:\n Episodic Memories: {memory["summary"]}\n\n{_LINE_SPACER}\n'
 
         return formatted_string
     
-    async def log_automated_suggestions(self, message: str, user_id: str, system_role_id: int, tokens: int):
-
-        # Generate UUID for Message
-        uid   = uuid.uuid4()
+    def log_automated_suggestions(self, message: str, user_id: str, system_role_id: int, tokens: int) -> None:
+        '''
+        Fire-and-forget: queues the row for the batched writer and returns immediately,
+        so callers don't await it and it never sits on a run()'s critical path.
+        '''
 
         # Insert Into Messages
         data = {
@@ -106,20 +470,84 @@ class OpenAIAgent:
             "system_role_id": system_role_id
         }
 
-        # Choose Messages Table
-        table_name = 'automated_suggestions'
-
-        # Supabase Client Insert and Execute Automated Message
-        self.supabase_client.table(table_name)\
-                            .insert(data)\
-                            .execute()
+        # Queue For The Batched Writer (see flush_automated_suggestions)
+        _log_queue().put_nowait((self.supabase_client, data))
 
         return 
     
 
 
 
-    async def run(self, user_id: str, jwt_token: str, system_role_id: int, supabase_client: Client, message: str = None) -> dict:
+    async def _run_json_agent(
+        self,
+        instructions: str,
+        message: Union[str, Dict[str, Any], None],
+        user_id: str,
+        system_role_id: int,
+    ) -> Union[dict, str]:
+        '''
+        Shared body of the single-shot JSON agents: (cached) Responses call -> output text ->
+        JSON parse -> queue input/output logs. Returns the parsed JSON when available, otherwise
+        the raw text -- or {} when the agent sets _JSON_ONLY.
+        message may be a {"cacheable_prefix", "dynamic_suffix"} dict (see _layout_message).
+        '''
+
+        message    = _layout_message(message)
+        api_params = {
+            "model": self.model,
+            "instructions": instructions,
+            "input": message,
+            "stream": False,
+            # Routes every call of this agent to the same prompt-cache shard
+            "extra_body": {"prompt_cache_key": f"{type(self).__name__}:{self.model}"},
+        }
+
+        resp = await _cached_responses_create(self.client, **api_params)
+
+        input_tokens     = resp.usage.input_tokens
+        output_tokens    = resp.usage.output_tokens
+
+        self.log_automated_suggestions(
+                message=message, user_id=user_id, system_role_id=system_role_id, tokens = input_tokens
+            )
+
+        try:
+            full_text = _extract_output_text(resp)
+            parsed    = _extract_json_from_text(full_text)
+
+            if self._JSON_ONLY and parsed is not None:
+                self.log_automated_suggestions(
+                    message=_orjson_dumps_str(parsed)[:8000],  # cap size (slice str, not bytes, to keep UTF-8 intact)
+                    user_id=user_id,
+                    system_role_id=system_role_id,
+                    tokens = output_tokens
+                )
+                return parsed
+
+            # Log raw text (also lets us inspect prompt alignment when JSON is missing)
+            self.log_automated_suggestions(
+                message=full_text, user_id=user_id, system_role_id=system_role_id, tokens = output_tokens
+            )
+
+            if self._JSON_ONLY:
+                return {}
+            # Prefer returning parsed JSON when available
+            return parsed if parsed else full_text
+
+        except Exception as e:
+            print(f"Error handling response: {e}")
+            print(f"Full response object: {resp}")
+            return {}
+
+    async def run(
+        self,
+        user_id: str,
+        jwt_token: str,
+        system_role_id: int,
+        supabase_client: Client,
+        message: str = None,
+        stream: bool = False,
+    ) -> Union[str, AsyncIterator[str]]:
         '''
         Workflow Triggered by the UI Workflow
 
@@ -128,11 +556,28 @@ class OpenAIAgent:
             jwt_token (str):
             uuid (str): 
             system_role_id (int): 
+            stream (bool): False -> one non-streaming call, returns the full response text.
+                           True  -> returns an async iterator yielding the text as it streams in,
+                                    in batches of up to STREAM_FLUSH_CHARS characters / STREAM_FLUSH_INTERVAL
+                                    seconds; callers join the yielded pieces for the full response.
         '''
 
         self.supabase_client = supabase_client
 
-        line_spacer = '-' * 60
+        api_params = await self._build_api_params(user_id = user_id, system_role_id = system_role_id, message = message)
+
+        if stream:
+            return self._stream_response(api_params)
+
+        response = await self.client.responses.create(**api_params, stream = False)
+        collected_response = _extract_output_text(response)
+
+        # 8. Store Agent Response
+        # self.log_automated_suggestions(message = collected_response, user_id = user_id, system_role_id = system_role_id)
+
+        return collected_response
+
+    async def _build_api_params(self, user_id: str, system_role_id: int, message: Optional[str]) -> dict:
 
         # Call Student Details (school and courses) and To Formatted Message
         student_details = self.pull_school_details(user_id = user_id)
@@ -141,18 +586,33 @@ class OpenAIAgent:
         episodic_memory = self.pull_episodic_memory(user_id = user_id, system_role_id = system_role_id)
 
         # Pull User Questionaires
-        lifestyle_priorities, social_priorities = await self.pull_user_questionaires(user_id)
+        questionaires = self.pull_user_questionaires(user_id)
 
-        # Run 2 DB calls/Inserts Asynchronously Since They Are Independent
-        student_details, episodic_memory = await asyncio.gather(student_details, episodic_memory)
+        # Run 3 DB calls Concurrently Since They Are Independent
+        student_details, episodic_memory, (lifestyle_priorities, social_priorities) = await asyncio.gather(
+            student_details, episodic_memory, questionaires
+        )
 
         # Contextualized Message for Academic Agent
         # Academic Agent
         if system_role_id == 3:
-            contextualized_message = f'The following is the students Lifestyle & Health Questionaire:\n\n\n{lifestyle_priorities}. \n\n\n The following is the students Social & Academic Questionaire:\n\n\n {social_priorities}.\n\n\n The following is the students academic profile: \n\n\n {student_details} \n\n\n{line_spacer}\n\n\n The following is the retrieved episodic memory: \n\n {episodic_memory}'
+            contextualized_message = _ACADEMIC_CONTEXT_TMPL.format(
+                lifestyle_priorities = lifestyle_priorities,
+                social_priorities    = social_priorities,
+                student_details      = student_details,
+                line_spacer          = _LINE_SPACER,
+                episodic_memory      = episodic_memory,
+            )
         # Jobs Analysis Agent
         elif system_role_id == 4:
-            contextualized_message = f'The following is the students Lifestyle & Health Questionaire:\n\n\n{lifestyle_priorities}. \n\n\n The following is the students Social & Academic Questionaire:\n\n\n {social_priorities}.\n\n\n The following is the students academic profile: \n\n\n {student_details} \n\n\n{line_spacer}\n\n\n The following is the retrieved episodic memory: \n\n {episodic_memory} \n\n\n The following is the extracted skills from a multiple of job opportunities {message}'
+            contextualized_message = _JOBS_CONTEXT_TMPL.format(
+                lifestyle_priorities = lifestyle_priorities,
+                social_priorities    = social_priorities,
+                student_details      = student_details,
+                line_spacer          = _LINE_SPACER,
+                episodic_memory      = episodic_memory,
+                message              = message,
+            )
 
 
         instructions = self.agent_instructions['prompt']
@@ -160,48 +620,70 @@ class OpenAIAgent:
         # The web search tool is activated directly
         tools_config = [{"type": "web_search_preview"}]
 
-        # Parameters for the API call
-        api_params = {
+        # Parameters for the API call (streaming is chosen per call in run)
+        return {
             "model": self.model,
             "instructions": instructions,
             "input": contextualized_message,
             "tools": tools_config,
-            "stream": True, # The Responses API also supports streaming
             "tool_choice": "required", # require that web tool is used
         }
 
-        response = self.client.responses.create(**api_params)
+    async def _stream_response(self, api_params: dict) -> AsyncIterator[str]:
+
+        response = await self.client.responses.create(**api_params, stream = True)
 
-        # 2. Collect Response and Stream
-        collected_response = ''
-        new_response_id = None # To store the ID for the next turn
+        # 2. Stream Response Outward, Batching Deltas To Cut Per-Chunk Framing Cost
+        pending: List[str] = []  # deltas not yet yielded
+        pending_chars      = 0
+        last_flush         = time.monotonic()
 
-        for event in response: # 'response' object itself acts as an async iterator for streaming
+        async for event in response: # 'response' object itself acts as an async iterator for streaming
             if hasattr(event, "type"):
                 if "text.delta" in event.type:
                     # This is a text chunk
                     content = event.delta
                     if content:
-                        collected_response += content
-    
-
-        # 8. Store Agent Response
-        # await self.log_automated_suggestions(message = collected_response, user_id = user_id, system_role_id = system_role_id)
-
-   
-        return collected_response
+                        pending.append(content)
+                        pending_chars += len(content)
+
+                        now = time.monotonic()
+                        if pending_chars >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_INTERVAL:
+                            yield ''.join(pending)
+                            pending.clear()
+                            pending_chars = 0
+                            last_flush    = now
+
+        if pending:
+            yield ''.join(pending)
     
 
 # -------- shared helpers --------
 
+def _layout_message(message: Union[str, Dict[str, Any], None]) -> str:
+    """
+    Render an agent message as Responses API input. OpenAI caches prompts by exact prefix
+    (instructions first, then input), so a {"cacheable_prefix": ..., "dynamic_suffix": ...}
+    dict is serialized prefix-first with sorted keys: every call sharing the prefix -- e.g.
+    content_instructions + source_text across a document's chunks -- sends the same leading bytes.
+    """
+    if isinstance(message, dict) and "cacheable_prefix" in message:
+        prefix = orjson.dumps(message["cacheable_prefix"], option=orjson.OPT_SORT_KEYS).decode()
+        suffix = orjson.dumps(message.get("dynamic_suffix") or {}, option=orjson.OPT_SORT_KEYS).decode()
+        return f"{prefix}\n{suffix}"
+    if isinstance(message, dict):
+        return _orjson_dumps_str(message)
+    return message or ""
+
 def _extract_output_text(resp: Any) -> str:
     """
     Try multiple plausible shapes from the OpenAI Responses API / Chat API.
     Returns empty string if nothing found.
     """
-    # New Responses API often exposes this:
-    if hasattr(resp, "output_text") and isinstance(resp.output_text, str):
-        return resp.output_text.strip()
+    # New Responses API exposes this (a computed property, so read it once):
+    output_text = getattr(resp, "output_text", None)
+    if isinstance(output_text, str):
+        return output_text.strip()
 
     # Fallback: responses with .output -> list of items with .content -> list of parts
     try:
@@ -239,43 +721,28 @@ def _extract_output_text(resp: Any) -> str:
         return ""
 
 
+_FENCE_RE = re.compile(r"```(?:json)?\s*(\{.*?\}|\[.*?\])\s*```", re.DOTALL)
+
+
 def _extract_json_from_text(full_text: str) -> Optional[dict]:
     """
-    Extract a JSON object either from a ```json ... ``` fenced block
+    Extract a JSON object either from a ```json ... ``` (or bare ```) fenced block
     or from the entire text (if it is raw JSON). Returns None if parsing fails.
     """
     if not isinstance(full_text, str) or not full_text:
         return None
 
-    # Try fenced block first
-    fence = "```json"
-    start = full_text.find(fence)
-    if start != -1:
-        start += len(fence)
-        end = full_text.find("```", start)
-        if end != -1:
-            candidate = full_text[start:end].strip()
-            try:
-                return json.loads(candidate)
-            except Exception:
-                pass
-
-    # Try any fenced code block (without explicit json)
-    fence2 = "```"
-    start2 = full_text.find(fence2)
-    if start2 != -1:
-        start2 += len(fence2)
-        end2 = full_text.find("```", start2)
-        if end2 != -1:
-            candidate2 = full_text[start2:end2].strip()
-            try:
-                return json.loads(candidate2)
-            except Exception:
-                pass
+    # Try fenced block first (single scan)
+    match = _FENCE_RE.search(full_text)
+    if match:
+        try:
+            return orjson.loads(match.group(1))
+        except Exception:
+            pass
 
     # Try raw JSON
     try:
-        return json.loads(full_text)
+        return orjson.loads(full_text)
     except Exception:
         return None
 
@@ -283,6 +750,9 @@ def _extract_json_from_text(full_text: str) -> Optional[dict]:
 # ============ Chunk Splitter ============
 
 class ChunkSplitterAgent(OpenAIAgent):
+    # Class-level, read-only instructions shared by every instance
+    _INSTRUCTIONS = MappingProxyType({"prompt": FLASHCARD_CHUNKER, "schema": None})
+
     def __init__(
         self,
         system_prompt: str,
@@ -291,16 +761,12 @@ class ChunkSplitterAgent(OpenAIAgent):
         jwt_token: str,
         model: str = "gpt-5-mini",
     ):
-        self.agent_instructions = self.get_system_prompt()  # uses constants
-        self.client = OpenAI(api_key=api_key)
+        self.client = get_openai_client(api_key)
         self.model = model
         self.uuid = uuid
         self.jwt_token = jwt_token
         self.prompt: Optional[str] = None  # avoid NameError
 
-    def get_system_prompt(self) -> Dict[str, Optional[str]]:
-        return {"prompt": FLASHCARD_CHUNKER, "schema": None}
-
     async def pull_user_questionaires(self, user_id: str):
         return
 
@@ -313,50 +779,16 @@ class ChunkSplitterAgent(OpenAIAgent):
         message: Optional[str] = None,
         university_information: str = "",
     ) -> Union[dict, str]:
-        
         self.supabase_client = supabase_client
-        instructions = self.agent_instructions["prompt"]
-        # response_format =  {
-        #     "type": "json_schema",
-        #     "json_schema": ChunkPayload,
-        #     "strict": True
-        # }
 
-        api_params = {
-            "model": self.model,
-            "instructions": instructions,
-            "input": message or "",
-            "stream": False
-        }
-
-        resp = self.client.responses.create(**api_params)
-
-
-        input_tokens     = resp.usage.input_tokens
-        output_tokens    = resp.usage.output_tokens
-
-        await self.log_automated_suggestions(
-                message=message, user_id=user_id, system_role_id=system_role_id, tokens = input_tokens
-            )
-
-        try:
-            full_text = _extract_output_text(resp)
-
-            # Try to parse JSON (chunker should return JSON)
-            parsed = _extract_json_from_text(full_text) or {}
-            await self.log_automated_suggestions(
-                message=full_text, user_id=user_id, system_role_id=system_role_id, tokens = output_tokens
-            )
-            # Prefer returning parsed JSON when available
-            return parsed if parsed else full_text
-
-        except Exception as e:
-            print(f"Error handling response: {e}")
-            print(f"Full response object: {resp}")
-            return {}
+        return await self._run_json_agent(
+            self._INSTRUCTIONS["prompt"], message, user_id=user_id, system_role_id=system_role_id
+        )
         
 
 class ContentInstructionAgent(OpenAIAgent):
+    _INSTRUCTIONS = MappingProxyType({"prompt": CONTENT_INSTRUCTIONS, "schema": None})
+
     def __init__(
         self,
         api_key: str,
@@ -364,16 +796,12 @@ class ContentInstructionAgent(OpenAIAgent):
         jwt_token: str,
         model: str = "gpt-5-mini",
     ):
-        self.agent_instructions = self.get_system_prompt()
-        self.client = OpenAI(api_key=api_key)
+        self.client = get_openai_client(api_key)
         self.model = model
         self.uuid = uuid
         self.jwt_token = jwt_token
         self.prompt: Optional[str] = None
 
-    def get_system_prompt(self) -> Dict[str, Optional[str]]:
-        return {"prompt": CONTENT_INSTRUCTIONS, "schema": None}
-
     async def pull_user_questionaires(self, user_id: str):
         return
 
@@ -388,44 +816,17 @@ class ContentInstructionAgent(OpenAIAgent):
     ) -> Union[dict, str]:
         self.supabase_client = supabase_client
 
-        instructions = self.agent_instructions["prompt"]
-
-        api_params = {
-            "model": self.model,
-            "instructions": instructions,
-            "input": message or "",
-            "stream": False,
-        }
-
-        resp = self.client.responses.create(**api_params)
-
-        input_tokens     = resp.usage.input_tokens
-        output_tokens    = resp.usage.output_tokens
-
-        await self.log_automated_suggestions(
-                message=message, user_id=user_id, system_role_id=system_role_id, tokens = input_tokens
-            )
-
-        try:
-            full_text = _extract_output_text(resp)
-
-            # Try to parse JSON (chunker should return JSON)
-            parsed = _extract_json_from_text(full_text) or {}
-            await self.log_automated_suggestions(
-                message=full_text, user_id=user_id, system_role_id=system_role_id, tokens = output_tokens
-            )
-            # Prefer returning parsed JSON when available
-            return parsed if parsed else full_text
-
-        except Exception as e:
-            print(f"Error handling response: {e}")
-            print(f"Full response object: {resp}")
-            return {}
+        return await self._run_json_agent(
+            self._INSTRUCTIONS["prompt"], message, user_id=user_id, system_role_id=system_role_id
+        )
 
 
 # ============ Flashcard Generator ============
 
 class FlashcardGeneratorAgent(OpenAIAgent):
+    _INSTRUCTIONS = MappingProxyType({"prompt": FLASHCARD_GENERATOR, "schema": None})
+    _JSON_ONLY    = True
+
     def __init__(
         self,
         system_prompt: str,
@@ -434,16 +835,12 @@ class FlashcardGeneratorAgent(OpenAIAgent):
         jwt_token: str,
         model: str = "gpt-5-mini",
     ):
-        self.agent_instructions = self.get_system_prompt()
-        self.client = OpenAI(api_key=api_key)
+        self.client = get_openai_client(api_key)
         self.model = model
         self.uuid = uuid
         self.jwt_token = jwt_token
         self.prompt: Optional[str] = None
 
-    def get_system_prompt(self) -> Dict[str, Optional[str]]:
-        return {"prompt": FLASHCARD_GENERATOR, "schema": None}
-
     async def run(
         self,
         user_id: str,
@@ -455,51 +852,46 @@ class FlashcardGeneratorAgent(OpenAIAgent):
     ) -> dict:
         self.supabase_client = supabase_client
 
-        instructions = self.agent_instructions["prompt"]
-
-        api_params = {
-            "model": self.model,
-            "instructions": instructions,
-            "input": message or "",
-            "stream": False,
-        }
-
-        resp = self.client.responses.create(**api_params)
-
-        input_tokens     = resp.usage.input_tokens
-        output_tokens    = resp.usage.output_tokens
-        
-        await self.log_automated_suggestions(
-                message=message, user_id=user_id, system_role_id=system_role_id, tokens = input_tokens
-            )
-
-        try:
-            full_text = _extract_output_text(resp)
-            json_obj = _extract_json_from_text(full_text)
-            if json_obj is None:
-                # Log raw text to inspect prompt alignment
-                await self.log_automated_suggestions(
-                    message=full_text, user_id=user_id, system_role_id=system_role_id, tokens = output_tokens
-                )
-                return {}
+        return await self._run_json_agent(
+            self._INSTRUCTIONS["prompt"], message, user_id=user_id, system_role_id=system_role_id
+        )
+
+
+async def generate_all(
+    generator: FlashcardGeneratorAgent,
+    chunks: List[str],
+    *,
+    user_id: str,
+    jwt_token: str,
+    system_role_id: int,
+    supabase_client: "Client",
+    max_concurrency: Optional[int] = None,
+) -> List[Union[dict, BaseException]]:
+    """
+    Run generator.run once per chunk message concurrently, with at most
+    max_concurrency (default OPENAI_MAX_CONCURRENCY) requests in flight.
+    Results keep the order of `chunks`; a failed chunk yields its exception instead of a dict.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or OPENAI_MAX_CONCURRENCY)
 
-            await self.log_automated_suggestions(
-                message=json.dumps(json_obj)[:8000],  # cap size
+    async def one(chunk: str) -> dict:
+        async with semaphore:
+            return await generator.run(
                 user_id=user_id,
+                jwt_token=jwt_token,
                 system_role_id=system_role_id,
-                tokens = output_tokens
+                supabase_client=supabase_client,
+                message=chunk,
             )
-            return json_obj
 
-        except Exception as e:
-            print(f"Error handling response: {e}")
-            print(f"Full response object: {resp}")
-            return {}
+    return await asyncio.gather(*(one(chunk) for chunk in chunks), return_exceptions=True)
 
 
 # ============ Flashcard QA/Dedupe ============
 
 class FlashcardQualityAgent(OpenAIAgent):
+    _INSTRUCTIONS = MappingProxyType({"prompt": FLASHCARD_QA, "schema": None})
+
     def __init__(
         self,
         system_prompt: str,
@@ -508,16 +900,12 @@ class FlashcardQualityAgent(OpenAIAgent):
         jwt_token: str,
         model: str = "gpt-5-mini",
     ):
-        self.agent_instructions = self.get_system_prompt()
-        self.client = OpenAI(api_key=api_key)
+        self.client = get_openai_client(api_key)
         self.model = model
         self.uuid = uuid
         self.jwt_token = jwt_token
         self.prompt: Optional[str] = None
 
-    def get_system_prompt(self) -> Dict[str, Optional[str]]:
-        return {"prompt": FLASHCARD_QA, "schema": None}
-
     async def pull_user_questionaires(self, user_id: str):
         return
 
@@ -532,33 +920,6 @@ class FlashcardQualityAgent(OpenAIAgent):
     ) -> Union[dict, str]:
         self.supabase_client = supabase_client
 
-        instructions = self.agent_instructions["prompt"]
-
-        api_params = {
-            "model": self.model,
-            "instructions": instructions,
-            "input": message or "",
-            "stream": False,
-        }
-
-        resp = self.client.responses.create(**api_params)
-
-        input_tokens     = resp.usage.input_tokens
-        output_tokens    = resp.usage.output_tokens
-
-        await self.log_automated_suggestions(
-                message=message, user_id=user_id, system_role_id=system_role_id, tokens = input_tokens
-            )
-
-        try:
-            full_text = _extract_output_text(resp)
-            parsed = _extract_json_from_text(full_text) or {}
-            await self.log_automated_suggestions(
-                message=full_text, user_id=user_id, system_role_id=system_role_id, tokens = output_tokens
-            )
-            return parsed if parsed else full_text
-
-        except Exception as e:
-            print(f"Error handling response: {e}")
-            print(f"Full response object: {resp}")
-            return {}
\ No newline at end of file
+        return await self._run_json_agent(
+            self._INSTRUCTIONS["prompt"], message, user_id=user_id, system_role_id=system_role_id
+        )
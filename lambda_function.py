@@ -1,97 +1,226 @@
+from __future__ import annotations
+
 import os
-import re
-import json
+import sys
+import orjson
 import asyncio
 import base64
-from io import BytesIO
-import cgi
-from typing import Any, Dict, List, Optional, Tuple
-from hashlib import sha256
+import mmap
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, List, Optional, Tuple, Union
+from blake3 import blake3
+from tempfile import SpooledTemporaryFile
+from python_multipart.multipart import MultipartParser, parse_options_header
+from datetime import datetime, timezone
+
+# supabase, agents (openai, httpx, asyncpg, ...) and utils (boto3) are imported where first used:
+# metadata-only requests never touch them, so cold starts skip loading them.
+if TYPE_CHECKING:
+    from supabase import AsyncClient
+    from agents import ContentInstructionAgent
+
+try:
+    import uvloop  # libuv-backed event loop; falls back to the stdlib loop when not installed
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
+# Long-lived event loop so pooled connections (asyncpg, HTTP) survive across warm invocations;
+# asyncio.run() would close the loop, and everything bound to it, after every request.
+_EVENT_LOOP = asyncio.new_event_loop()
+asyncio.set_event_loop(_EVENT_LOOP)
+
+
+# ---- Warm-start singletons ----
+# Lambda reuses the process across invocations, so clients and agents are built once per container
+# and per-request identity travels only through headers / run() kwargs.
+
+_SUPABASE: Optional[AsyncClient] = None
+_CONTENT_INSTRUCTORS: Dict[Tuple[str, str], ContentInstructionAgent] = {}
+
+def _get_supabase(url: str, key: str) -> AsyncClient:
+    """Process-wide user-scoped client; the handler swaps the caller's bearer onto it per request."""
+    global _SUPABASE
+    if _SUPABASE is None:
+        from supabase import create_async_client
+        _SUPABASE = _EVENT_LOOP.run_until_complete(create_async_client(url, key))
+    return _SUPABASE
+
+def _drop_supabase() -> None:
+    """Forget the shared client (e.g. its bearer could not be replaced); the next request builds a fresh one."""
+    global _SUPABASE
+    _SUPABASE = None
+
+def _get_content_instructor(api_key: str, model: str) -> ContentInstructionAgent:
+    agent = _CONTENT_INSTRUCTORS.get((api_key, model))
+    if agent is None:
+        # --- import your agents (from your module) ---
+        from agents import ContentInstructionAgent
+        agent = ContentInstructionAgent(api_key=api_key, uuid=None, jwt_token=None, model=model)
+        _CONTENT_INSTRUCTORS[(api_key, model)] = agent
+    return agent
+
 
+# ---- Helpers ----
 
-from supabase import create_client, Client
-from datetime import datetime
-from openai import OpenAI
+UPLOAD_SPOOL_SIZE = 1_048_576   # file fields spill from memory to /tmp past 1 MB
+PDF_SCAN_BYTES    = 5_000_000   # page-count heuristic only looks at the head of the file
 
-# --- import your agents (from your module) ---
-from agents import ChunkSplitterAgent, FlashcardGeneratorAgent, FlashcardQualityAgent, ContentInstructionAgent
-from utils import extract_manifest_from_binary, extract_text_from_binary
+# Page objects as PDF writers spell them; '/Type /Page' also matches the '/Type /Pages' tree nodes
+_PAGE_MARKERS      = (b"/Type /Page", b"/Type/Page")
+_PAGE_TREE_MARKERS = (b"/Type /Pages", b"/Type/Pages")
 
 
-# ---- Helpers ----
+def _read_head(content: Union[bytes, BinaryIO], size: int) -> bytes:
+    """First `size` bytes of an upload, leaving a file-like content rewound."""
+    if isinstance(content, (bytes, bytearray)):
+        return bytes(content[:size])
+    head = content.read(size)
+    content.seek(0)
+    return head
 
+FILE_SNIFF_BYTES = 16
 
-def _guess_file_type(filename: Optional[str], declared: Optional[str], content: bytes) -> str:
+def _guess_file_type(filename: Optional[str], declared: Optional[str], content_prefix: bytes) -> str:
+    """content_prefix: the first FILE_SNIFF_BYTES of the upload (see _read_head), never the whole body."""
     if declared:
         return declared
     if filename and filename.lower().endswith(".pdf"):
         return "application/pdf"
-    if content.startswith(b"%PDF"):
+    if content_prefix.startswith(b"%PDF"):
         return "application/pdf"
     return "application/octet-stream"
 
-def _count_pdf_pages_fast(pdf_bytes: bytes) -> Optional[int]:
+def _count_marker(buf: Union[bytes, bytearray, mmap.mmap], marker: bytes, end: int) -> int:
+    """Occurrences of marker within buf[:end]; bytes.count takes bounds natively, mmap only has find."""
+    if not isinstance(buf, mmap.mmap):
+        return buf.count(marker, 0, end)
+    n, pos = 0, buf.find(marker, 0, end)
+    while pos != -1:
+        n  += 1
+        pos = buf.find(marker, pos + len(marker), end)
+    return n
+
+def _count_pdf_markers(buf: Union[bytes, bytearray, mmap.mmap]) -> Optional[int]:
+    if buf[:4] != b"%PDF":
+        return None
+    # look only at a slice for speed on Lambda (bounded in place, no 5 MB copy)
+    end = min(len(buf), PDF_SCAN_BYTES)
+    try:
+        # Literal scans run in C; subtract the page-tree nodes the shorter markers also hit
+        pages = sum(_count_marker(buf, marker, end) for marker in _PAGE_MARKERS)
+        trees = sum(_count_marker(buf, marker, end) for marker in _PAGE_TREE_MARKERS)
+        return (pages - trees) or None
+    except Exception:
+        return None
+
+def _count_pdf_pages_fast(pdf: Union[bytes, BinaryIO]) -> Optional[int]:
     """
     Lightweight heuristic for PDF page count (good enough for mobile/web preview).
     Avoids heavy libs. Returns None if not a PDF or can’t infer.
     """
-    if not pdf_bytes.startswith(b"%PDF"):
-        return None
-    # look only at a slice for speed on Lambda
-    sample = pdf_bytes[:5_000_000]
-    try:
-        # Count '/Type /Page' not followed by 's' (avoid '/Pages').
-        return len(re.findall(br"/Type\s*/Page([^s]|$)", sample)) or None
-    except Exception:
+    if isinstance(pdf, (bytes, bytearray)):
+        return _count_pdf_markers(pdf)
+
+    # Still in memory (SpooledTemporaryFile under its 1 MB threshold): the head read is small
+    if not hasattr(pdf, "fileno") or not getattr(pdf, "_rolled", True):
+        return _count_pdf_markers(_read_head(pdf, PDF_SCAN_BYTES))
+
+    # On disk: map the head and scan the page cache in place
+    size = os.fstat(pdf.fileno()).st_size
+    if not size:
         return None
+    with mmap.mmap(pdf.fileno(), length=min(size, PDF_SCAN_BYTES), access=mmap.ACCESS_READ) as sample:
+        return _count_pdf_markers(sample)
 
 def _get_body_and_headers(event) -> Tuple[bytes, Dict[str, str]]:
     if event.get("isBase64Encoded"):
         body = base64.b64decode(event["body"])
     else:
         body = event["body"].encode() if isinstance(event.get("body"), str) else (event.get("body") or b"")
+    # API Gateway HTTP APIs already send lowercase names; REST APIs don't, so normalize once here
     headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
     return body, headers
 
 
 def _parse_multipart(body: bytes, content_type: str) -> Dict[str, Any]:
     """
-    Parses multipart/form-data using cgi.FieldStorage.
+    Parses multipart/form-data with python-multipart's callback parser.
     Returns a dict of fields; file fields include:
-      { "filename": str, "content": bytes, "type": str }
+      { "filename": str, "content": SpooledTemporaryFile (rewound), "type": str }
     - Text fields become strings.
     - If a field occurs multiple times, value is a list (preserves all).
     """
-    env = {
-        "REQUEST_METHOD": "POST",
-        "CONTENT_TYPE": content_type,
-        "CONTENT_LENGTH": str(len(body)),
-    }
-    form = cgi.FieldStorage(fp=BytesIO(body), environ=env, keep_blank_values=True)
+    _, params = parse_options_header(content_type)
+    boundary  = params.get(b"boundary")
+    if not boundary:
+        return {}
 
     fields: Dict[str, Any] = {}
-    if form.list:
-        for field in form.list:
-            key = field.name
-            if field.filename:  # file upload
-                value = {
-                    "filename": field.filename,
-                    "content": field.file.read() if hasattr(field.file, "read") else field.value.encode(),
-                    "type": field.type,
-                }
+    part: Dict[str, Any]   = {}
+
+    def on_part_begin() -> None:
+        part.clear()
+        part.update(headers={}, field=bytearray(), value=bytearray())
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        part["value"] += data[start:end]
+
+    def on_header_end() -> None:
+        part["headers"][bytes(part["field"]).lower()] = bytes(part["value"])
+        part["field"].clear()
+        part["value"].clear()
+
+    def on_headers_finished() -> None:
+        _, disposition   = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"]     = disposition.get(b"name", b"").decode("utf-8", "replace")
+        part["filename"] = disposition.get(b"filename")
+        # Uploads spool to disk once large; text fields stay in memory
+        part["data"]     = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE) if part["filename"] else bytearray()
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        chunk = memoryview(data)[start:end]
+        if isinstance(part["data"], bytearray):
+            part["data"] += chunk
+        else:
+            part["data"].write(chunk)
+
+    def on_part_end() -> None:
+        key = part["name"]
+
+        if part["filename"]:  # file upload
+            declared = part["headers"].get(b"content-type")
+            part["data"].seek(0)
+            value = {
+                "filename": part["filename"].decode("utf-8", "replace"),
+                "content": part["data"],
+                "type": declared.decode("latin-1") if declared else None,
+            }
+        else:
+            value = part["data"].decode("utf-8", "replace")  # string
 
-                # Convert Binary Text to Text with LlamaParse
-            else:
-                value = field.value  # string
-
-            # support repeated keys -> list
-            if key in fields:
-                if isinstance(fields[key], list):
-                    fields[key].append(value)
-                else:
-                    fields[key] = [fields[key], value]
+        # support repeated keys -> list
+        if key in fields:
+            if isinstance(fields[key], list):
+                fields[key].append(value)
             else:
-                fields[key] = value
+                fields[key] = [fields[key], value]
+        else:
+            fields[key] = value
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    parser.write(body)
+    parser.finalize()
     return fields
 
 def _extract_input_text(fields: Dict[str, Any]) -> Tuple[str, Optional[str]]:
@@ -207,12 +336,59 @@ def _extract_flashcards(data: Dict[str, Any]) -> List[Dict[str, Any]]:
 
     return results
 
+async def _find_cached_cards(
+    supabase: AsyncClient, user_id: str, source_hash: str
+) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    (source_id, cards) when this user already generated cards from identical text, else None.
+    Cards come from the most recent prior deck so repeated hits don't compound earlier copies.
+    """
+    res = await supabase.table("flashcard_sources") \
+                        .select("id, flashcards(deck_id, section_title, subsection_title, context, front, back, notes)") \
+                        .eq("user_id", user_id) \
+                        .eq("hash", source_hash) \
+                        .order("created_at", desc=True, foreign_table="flashcards") \
+                        .limit(1) \
+                        .execute()
+    if not res.data or not res.data[0].get("flashcards"):
+        return None
+
+    # Embedded rows have no inherent order; newest first makes cards[0] the latest run's deck
+    cards       = res.data[0]["flashcards"]
+    latest_deck = cards[0]["deck_id"]
+    return res.data[0]["id"], [c for c in reversed(cards) if c["deck_id"] == latest_deck]
+
+async def _get_or_create_source(supabase: AsyncClient, user_id: str, input_text: str, source_hash: str) -> str:
+    """
+    Return the id of this user's flashcard_sources row for input_text, inserting it if needed.
+    One UPSERT on the UNIQUE (user_id, hash) constraint reuses an identical source in a single round-trip.
+    """
+    src_res = await supabase.table("flashcard_sources").upsert({
+        "user_id": user_id,
+        "title": "Uploaded text",
+        "text": input_text,           # omit if huge; or store excerpt
+        "hash": source_hash,
+        "metadata": {"language": "und"}
+    }, on_conflict="user_id,hash", ignore_duplicates=False).execute()
+
+    return src_res.data[0]["id"]
+
+async def _create_deck(supabase: AsyncClient, user_id: str, source_id: str) -> Optional[str]:
+    deck_name = f"Generated Deck {datetime.now(timezone.utc).isoformat(timespec='seconds')}"
+    deck_res = await supabase.table("flashcard_decks").insert({
+        "user_id": user_id,
+        "deck_name": deck_name,
+        "source_id": source_id,
+    }).execute()
+
+    return (deck_res.data[0]["id"] if deck_res.data else None)
+
 # ---- Pipeline ----
 
 async def _run_pipeline(
     *,
     input_text: str,
-    supabase: Client,
+    supabase: AsyncClient,
     gpt_api_key: str,
     model: str,
     user_id: str,
@@ -223,64 +399,46 @@ async def _run_pipeline(
     """
     Runs ChunkSplitter → Generator → QA. If QA rejects too many, loop back once to Generator.
     Inserts accepted cards into Supabase and returns a structured response.
+    Re-uploads of identical text reuse the user's earlier cards without calling the LLM.
     """
 
-    # Initialize agents
-    
-    content_instructor = ContentInstructionAgent(
-        api_key=gpt_api_key,
-        uuid=user_id,
-        jwt_token=jwt_token,
-        model=model
-    )
+    # Create Text Encoded Hash (dedup key, not a security boundary -- blake3 is SIMD-fast; 64 hex chars like sha256)
+    source_hash = blake3(input_text.encode("utf-8")).hexdigest()
 
-    print('candiate cards')
-    flashcards = await content_instructor.run(
-                            user_id=user_id,
-                            jwt_token=jwt_token,
-                            system_role_id=9,
-                            supabase_client=supabase,
-                            message=input_text
-                        )
-    
-    print('flashcards', flashcards)
-    
-    # Create Text Encoded Hash
-    source_hash = sha256(input_text.encode("utf-8")).hexdigest()
+    # Same user, same text: copy last run's cards into this deck and skip the LLM entirely
+    cached = await _find_cached_cards(supabase, user_id, source_hash)
+
+    if cached is not None:
+        source_id, cards = cached
+        if not deck_id:
+            deck_id = await _create_deck(supabase, user_id, source_id)
 
-    # # Try to reuse an identical source for this user (optional)
-    existing = supabase.table("flashcard_sources").select("id").eq("user_id", user_id).eq("hash", source_hash).limit(1).execute()
-    if existing.data:
-        source_id = existing.data[0]["id"]
     else:
-        src_res = supabase.table("flashcard_sources").insert({
-            "user_id": user_id,
-            "title": "Uploaded text",
-            "text": input_text,           # omit if huge; or store excerpt
-            "hash": source_hash,
-            "metadata": {"language": "und"}
-        }).execute()
+        content_instructor = _get_content_instructor(gpt_api_key, model)
 
-        source_id = src_res.data[0]["id"]
+        # The source upsert doesn't depend on the LLM output and is idempotent (keyed by hash), so
+        # write it while the model runs; the deck waits for a successful generation so a failed
+        # LLM call never leaves an empty deck behind
+        flashcards, source_id = await asyncio.gather(
+            content_instructor.run(
+                user_id=user_id,
+                jwt_token=jwt_token,
+                system_role_id=9,
+                supabase_client=supabase,
+                message=input_text
+            ),
+            _get_or_create_source(supabase, user_id, input_text, source_hash),
+        )
+        cards = _extract_flashcards(flashcards)
 
+        if not deck_id:
+            deck_id = await _create_deck(supabase, user_id, source_id)
 
     # 5) Persist to Supabase
-    # Ensure or create a deck if not provided:
-    if not deck_id:
-        # print('deck this')
-        deck_name = f"Generated Deck {datetime.now()}"
-        deck_res = supabase.table("flashcard_decks").insert({
-            "user_id": user_id,
-            "deck_name": deck_name,
-            "source_id": source_id,
-        }).execute()
-
-        deck_id = (deck_res.data[0]["id"] if deck_res.data else None)
-
     # Prepare batch insert for 'cards' table (align to your schema)
     rows = []
 
-    for c in _extract_flashcards(flashcards):
+    for c in cards:
         rows.append({
             "user_id": user_id,
             "deck_id": deck_id,
@@ -295,13 +453,15 @@ async def _run_pipeline(
         })
 
 
+    inserted_count = 0
     if rows:
-        ins = supabase.table("flashcards").insert(rows).execute()
-        inserted = ins.data or []
+        # Only the count is used, so skip echoing every inserted row back over the wire
+        ins = await supabase.table("flashcards").insert(rows, returning="minimal", count="exact").execute()
+        inserted_count = ins.count if ins.count is not None else len(rows)
 
     return {
         "deck_id": deck_id,
-        "inserted_count": len(inserted),
+        "inserted_count": inserted_count,
         "accepted_preview": rows,  # preview for frontend
     }
 
@@ -317,7 +477,7 @@ def lambda_function(event, context):
 
     # Parse body/headers early
     body, headers = _get_body_and_headers(event)
-    origin = (headers.get("origin") or headers.get("Origin") or "").strip()
+    origin = (headers.get("origin") or "").strip()
 
     # CORS preflight
     if event.get("requestContext", {}).get("http", {}).get("method") == "OPTIONS":
@@ -347,37 +507,43 @@ def lambda_function(event, context):
                 return {
                     "statusCode": 400,
                     "headers": _cors_headers(origin),
-                    "body": json.dumps({"error": "Missing 'file' for metadata"}),
+                    "body": orjson.dumps({"error": "Missing 'file' for metadata"}).decode(),
                 }
             
-            ftype    = _guess_file_type(filename, declared, content)
+            ftype    = _guess_file_type(filename, declared, _read_head(content, FILE_SNIFF_BYTES))
             page_count = _count_pdf_pages_fast(content) if ftype == "application/pdf" else None
 
             return {
                 "statusCode": 200,
                 "headers": _cors_headers(origin),
-                "body": json.dumps({"ok": True, "type": ftype, "pageCount": page_count}),
+                "body": orjson.dumps({"ok": True, "type": ftype, "pageCount": page_count}).decode(),
             }
         
 
+
+        # Spooled uploads are read back in full only once we know we're generating
+        if hasattr(input_text, "read"):
+            input_text = input_text.read()
+
         # If no action provided on multipart, default to generate (backward compatibility)
-        elif action == 'generate':
+        if action == 'generate':
+            from utils import extract_text_from_binary
             input_text = extract_text_from_binary(input_text, filename)
 
 
     elif content_type.startswith("application/json"):
         try:
-            data = json.loads(body.decode() if isinstance(body, bytes) else body)
+            data = orjson.loads(body)  # takes bytes directly, no decode pass
             if isinstance(data, str):
                 try:
-                    data = json.loads(data)
-                except json.JSONDecodeError:
+                    data = orjson.loads(data)
+                except orjson.JSONDecodeError:
                     data = {"text": data}
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return {
                 "statusCode": 400,
                 "headers": _cors_headers(origin),
-                "body": json.dumps({"error": "Invalid JSON body"}),
+                "body": orjson.dumps({"error": "Invalid JSON body"}).decode(),
             }
 
         # 👉 NEW: capture action (default to generate)
@@ -391,7 +557,7 @@ def lambda_function(event, context):
         return {
             "statusCode": 400,
             "headers": _cors_headers(origin),
-            "body": json.dumps({"error": "Content-Type must be multipart/form-data or application/json"}),
+            "body": orjson.dumps({"error": "Content-Type must be multipart/form-data or application/json"}).decode(),
         }
     
     
@@ -403,7 +569,7 @@ def lambda_function(event, context):
             return {
                 "statusCode": 400,
                 "headers": _cors_headers(origin),
-                "body": json.dumps({"error": "No text/JS content found in request"}),
+                "body": orjson.dumps({"error": "No text/JS content found in request"}).decode(),
             }
         
     # ── Auth context (upstream Lambda authorizer already did asymmetric verification) ──
@@ -414,29 +580,33 @@ def lambda_function(event, context):
     access_token = (
         auth_ctx.get("access_token")
         or auth_ctx.get("token")
-        or (headers.get("authorization") or headers.get("Authorization") or "").replace("Bearer ", "").strip()
+        or (headers.get("authorization") or "").replace("Bearer ", "").strip()
     )
 
 
-    # Create Supabase clients:
-    #  1) User-scoped client (RLS enforced) -> pass to pipeline
+    # Supabase clients:
+    #  1) User-scoped client (RLS enforced) -> pass to pipeline; reused across warm invocations
     #  2) Admin client (service role)       -> keep if you need privileged ops
-    supabase_user: Client  = create_client(supabase_url, supabase_anon)
+    supabase_user: AsyncClient = _get_supabase(supabase_url, supabase_anon)
 
-    # Attach JWT to user client so PostgREST runs under user's RLS context
-    if access_token:
-        try:
-            supabase_user.postgrest.auth(access_token)
-        except Exception:
-            # Older client fallback
-            try:
-                supabase_user.auth.set_session(access_token=access_token, refresh_token="")
-            except Exception:
-                pass
+    # Attach JWT to user client so PostgREST runs under user's RLS context.
+    # The client is shared, so always replace the previous caller's bearer (anon key when unauthenticated).
+    try:
+        supabase_user.postgrest.auth(access_token or supabase_anon)
+    except Exception as e:
+        # Never query through the shared client while it may still carry the previous caller's
+        # bearer (that would run under their RLS identity); rebuild it on the next request instead
+        print("Supabase auth error:", e)
+        _drop_supabase()
+        return {
+            "statusCode": 500,
+            "headers": _cors_headers(origin),
+            "body": orjson.dumps({"error": "Internal Server Error", "details": "Could not scope database client to caller"}).decode(),
+        }
 
     # ── Main flow ───────────────────────────────────────────────────────────────
     try:
-        result = asyncio.run(
+        result = _EVENT_LOOP.run_until_complete(
             _run_pipeline(
                 input_text=input_text,
                 supabase=supabase_user,   # run DB ops under user's RLS
@@ -451,7 +621,7 @@ def lambda_function(event, context):
         return {
             "statusCode": 200,
             "headers": _cors_headers(origin),
-            "body": json.dumps({"message": "success", "result": result}),
+            "body": orjson.dumps({"message": "success", "result": result}).decode(),
         }
 
     except Exception as e:
@@ -459,5 +629,11 @@ def lambda_function(event, context):
         return {
             "statusCode": 500,
             "headers": _cors_headers(origin),
-            "body": json.dumps({"error": "Internal Server Error", "details": str(e)}),
+            "body": orjson.dumps({"error": "Internal Server Error", "details": str(e)}).decode(),
         }
+
+    finally:
+        # Write any queued agent logs before Lambda freezes the container (nothing to flush if no agent ran)
+        agents = sys.modules.get("agents")
+        if agents is not None:
+            _EVENT_LOOP.run_until_complete(agents.flush_automated_suggestions())
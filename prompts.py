@@ -1,7 +1,24 @@
 from datetime import datetime
 
+# These prompts are sent verbatim as the Responses API `instructions`, i.e. the first thing in
+# every request. OpenAI caches prompt prefixes automatically (>= 1024 tokens, exact bytes), so
+# keep them static: never interpolate per-call or per-day values into them. Anything dynamic,
+# like the date below, belongs at the end of the `input` instead.
 todays_date = datetime.now().strftime('%m-%d-%Y')
 
+# Card Fields Shared By The GENERATOR And QA Schemas; Concatenated At Import So
+# Both Prompts Stay Static Strings And Cannot Drift Apart
+_CARD_CONTENT_FIELDS = '''      "front": "string",
+      "back": "string",
+      "hint": "string|null",
+      "tags": ["string"],
+      "source_span": { "start": int, "end": int },
+'''
+
+_CARD_MEDIA_FIELDS = '''        "process_steps": ["string"] | null,
+        "media": { "audio_text": "string|null", "image_caption": "string|null" }
+'''
+
 FLASHCARD_CHUNKER='''
 
 You are CHUNKER, a deterministic text segmenter for ANY long-form source (textbook, research article, web page, PDF/scan, technical doc, code tutorial, etc.). Your job is to slice INPUT_TEXT into ordered, non-overlapping chunks that are stable and traceable.
@@ -129,17 +146,10 @@ JSON schema (per batch)
   "cards": [
     {
       "type": "basic" | "table" | "process" | "concept_check",
-      "front": "string",
-      "back": "string",
-      "hint": "string|null",
-      "tags": ["string"],
-      "source_span": { "start": int, "end": int },
-      "difficulty": 1 | 2 | 3 | 4 | 5,
+''' + _CARD_CONTENT_FIELDS + '''      "difficulty": 1 | 2 | 3 | 4 | 5,
       "extras": {
         "table_data": { "columns": ["string", ...], "rows": [["string", ...]] } | null,
-        "process_steps": ["string"] | null,
-        "media": { "audio_text": "string|null", "image_caption": "string|null" }
-      }
+''' + _CARD_MEDIA_FIELDS + '''      }
     }
   ],
   "estimated_total_for_chunk": int
@@ -203,17 +213,10 @@ Output ONLY JSON in this schema:
     {
       "id": "string|null",
       "type": "basic"|"cloze"|"table"|"process"|"concept_check",
-      "front": "string",
-      "back": "string",
-      "hint": "string|null",
-      "tags": ["string"],
-      "source_span": { "start": int, "end": int },
-      "difficulty": 1|2|3|4|5,
+''' + _CARD_CONTENT_FIELDS + '''      "difficulty": 1|2|3|4|5,
       "extras": {
         "table_data": { "columns": ["string",...], "rows": [["string",...]] } | null,
-        "process_steps": ["string"] | null,
-        "media": { "audio_text": "string|null", "image_caption": "string|null" }
-      },
+''' + _CARD_MEDIA_FIELDS + '''      },
       "qa": {
         "traceability_ok": true,
         "factual_ok": true,
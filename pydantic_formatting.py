@@ -1,8 +1,12 @@
 import re
-import json
-from typing import List, Optional, Literal, Annotated, Any, Type
-
-from pydantic import BaseModel, Field, model_validator, ValidationError
+import hashlib
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterable, Iterator, List, Optional, Literal, Annotated, Any, Tuple, Type
+
+from pydantic import BaseModel, Field, TypeAdapter, model_validator, ValidationError
 from pydantic.config import ConfigDict
 
 # Reusable constrained aliases (no call expressions in the type slot)
@@ -20,11 +24,18 @@ Kind = Optional[Literal[
 
 
 ### Chunk Spitter Pydantic Objects ###
+# Small leaf models (spans, media) are frozen: hashable, so they work as dedupe keys.
+# The payload lists are fail_fast: a bad LLM response is rejected at its first invalid item
+# rather than after pydantic walks (and collects errors for) every remaining chunk/card.
 class Span(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     start: NonNegInt
     end: NonNegInt
 
 class ListItemRange(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     start: PosInt
     end: PosInt
 
@@ -49,12 +60,14 @@ class DocStats(BaseModel):
 class ChunkPayload(BaseModel):
     doc_stats: DocStats
     # Use Field(min_length=1) on the list to enforce non-empty
-    chunks: Annotated[List[Chunk], Field(min_length=1)]
+    chunks: Annotated[List[Chunk], Field(min_length=1, fail_fast=True)]
 
 ### Chunk Generator Pydantic Objects ###
 
 # -------- Leaf objects --------
 class SourceSpan(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     start: NonNegInt
     end: NonNegInt  # inclusive-exclusive by your convention
 
@@ -67,16 +80,19 @@ class TableData(BaseModel):
         col_count = len(self.columns)
         # If columns empty, allow only empty rows
         if col_count == 0:
-            if any(len(r) != 0 for r in self.rows):
+            if any(self.rows):
                 raise ValueError("rows must be empty lists when columns is empty")
             return self
-        # Otherwise, every row must match columns length
-        for i, r in enumerate(self.rows):
-            if len(r) != col_count:
-                raise ValueError(f"rows[{i}] length {len(r)} != columns length {col_count}")
+        # Otherwise, every row must match columns length (widths taken in C; locate the bad row only on failure)
+        lens = set(map(len, self.rows))
+        if lens and lens != {col_count}:
+            i, r = next((i, r) for i, r in enumerate(self.rows) if len(r) != col_count)
+            raise ValueError(f"rows[{i}] length {len(r)} != columns length {col_count}")
         return self
 
 class Media(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     audio_text: Optional[NonEmptyStr] = None
     image_caption: Optional[NonEmptyStr] = None
 
@@ -103,7 +119,7 @@ class CardsPayload(BaseModel):
     stage: Literal["cards"]
     chunk_index: NonNegInt
     batch_index: NonNegInt
-    cards: Annotated[List[Card], Field(min_length=1)]
+    cards: Annotated[List[Card], Field(min_length=1, fail_fast=True)]
     estimated_total_for_chunk: NonNegInt
 
 
@@ -140,8 +156,20 @@ class Summary(BaseModel):
 # ---------- Top-level payload ----------
 class QAReviewPayload(BaseModel):
     summary: Summary
-    accepted: List[AcceptedCard] = Field(default_factory=list)
-    rejected: List[RejectedItem] = Field(default_factory=list)
+    accepted: List[AcceptedCard] = Field(default_factory=list, fail_fast=True)
+    rejected: List[RejectedItem] = Field(default_factory=list, fail_fast=True)
+
+# ---------- Card-list validators ----------
+# For callers that only need the cards: validate the list in one pydantic-core call
+# without building (or checking the other fields of) the wrapper payload.
+_CARDS_ADAPTER    = TypeAdapter(Annotated[List[Card], Field(fail_fast=True)])
+_ACCEPTED_ADAPTER = TypeAdapter(Annotated[List[AcceptedCard], Field(fail_fast=True)])
+
+def validate_cards(items: Any) -> List[Card]:
+    return _CARDS_ADAPTER.validate_python(items)
+
+def validate_accepted(items: Any) -> List[AcceptedCard]:
+    return _ACCEPTED_ADAPTER.validate_python(items)
 
 
 
@@ -151,98 +179,223 @@ class StrictModel(BaseModel):
 
 # ---------- 1) Get text content from a Responses API object ----------
 def responses_text(resp: Any) -> str:
-    # Works with the Python SDK’s convenience; otherwise fall back.
-    if hasattr(resp, "output_text") and resp.output_text:
-        return resp.output_text
-
-    parts = []
-    for item in getattr(resp, "output", []) or []:
-        for c in getattr(item, "content", []) or []:
-            # Typical fields: {"type":"output_text","text":"..."} or {"type":"input_text",...}
-            if c.get("type") in ("output_text", "text"):
-                t = c.get("text") or c.get("content") or ""
-                parts.append(t)
-    return "\n".join(parts).strip()
+    # Works with the Python SDK’s convenience (a computed property, so read it once); otherwise fall back.
+    output_text = getattr(resp, "output_text", None)
+    if output_text:
+        return output_text
+
+    # Typical fields: {"type":"output_text","text":"..."} or {"type":"input_text",...}
+    return "\n".join(
+        c.get("text") or c.get("content") or ""
+        for item in (getattr(resp, "output", None) or ())
+        for c in (getattr(item, "content", None) or ())
+        if c.get("type") in ("output_text", "text")
+    ).strip()
 
 # ---------- 2) Extract JSON from possibly-messy text ----------
-_JSON_BLOCK_RE = re.compile(
-    r"```(?:json)?\s*(\{.*?\}|\[.*?\])\s*```",
-    re.DOTALL
-)
+# Only the characters that change bracket/string state; the scan below jumps between them in C
+_JSON_TOKEN_RE = re.compile(r'[{}\[\]"\\]')
+
+def _find_json_span(s: str, begin: int) -> Optional[int]:
+    """
+    End (exclusive) of the balanced {...} / [...] that opens at s[begin], in one linear pass.
+    Tracks string/escape state so brackets inside JSON strings don't count. None if it never closes.
+    """
+    depth      = 0
+    in_string  = False
+    skip_until = -1  # index just past an escaped character
+    for m in _JSON_TOKEN_RE.finditer(s, begin):
+        i = m.start()
+        if i < skip_until:
+            continue
+        ch = s[i]
+        if in_string:
+            if ch == "\\":
+                skip_until = i + 2
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+def _strip_fence(s: str) -> str:
+    """Body of the first closed ``` fence (its ```json tag line dropped), wherever it starts; else s."""
+    i = s.find("```")
+    if i < 0:
+        return s
+    j = s.find("\n", i) + 1
+    k = s.find("```", j) if j else -1
+    return s[j:k] if k > 0 else s
+
+def _json_spans(s: str, opener: str) -> Iterator[str]:
+    """Balanced spans of s starting at each `opener`, in order."""
+    begin = s.find(opener)
+    while begin != -1:
+        end = _find_json_span(s, begin)
+        if end is not None:
+            yield s[begin:end]
+        begin = s.find(opener, begin + 1)  # not JSON (or never closed); try the next opener
+
+def _outer_span(s: str, opener: str, closer: str) -> Iterator[str]:
+    """First opener .. last closer, the coarse fallback for output the bracket scan can't split."""
+    first, last = s.find(opener), s.rfind(closer)
+    if first != -1 and last > first:
+        yield s[first:last + 1]
+
+def _json_candidates(s: str) -> Iterator[str]:
+    """
+    Possible JSON payloads of s, most likely first; the caller decides which one actually parses.
+    Objects are preferred over arrays, so a bracketed aside in the prose ("see [2]") loses to the payload.
+    """
+    s = s.strip()
+    yield s  # the model returned bare JSON
+    body = _strip_fence(s)
+    if body is not s:
+        yield body.strip()
+    yield from _json_spans(s, "{")
+    yield from _outer_span(s, "{", "}")
+    yield from _json_spans(s, "[")
+    yield from _outer_span(s, "[", "]")
 
 def extract_json_block(s: str) -> str:
-    s = s.strip()
-    # a) try direct parse
-    try:
-        json.loads(s)
-        return s
-    except Exception:
-        pass
-
-    # b) try fenced ```json ... ``` or ``` ... ```
-    m = _JSON_BLOCK_RE.search(s)
-    if m:
-        return m.group(1)
-
-    # c) last-resort: grab the first top-level {...} (brace matching)
-    first = s.find("{")
-    last  = s.rfind("}")
-    if first != -1 and last != -1 and last > first:
-        candidate = s[first:last+1]
-        # quick sanity check
+    for candidate in _json_candidates(s):
         try:
-            json.loads(candidate)
+            orjson.loads(candidate)
             return candidate
-        except Exception:
-            pass
-
-    # d) try array fallback
-    first = s.find("[")
-    last  = s.rfind("]")
-    if first != -1 and last != -1 and last > first:
-        candidate = s[first:last+1]
-        try:
-            json.loads(candidate)
-            return candidate
-        except Exception:
-            pass
+        except orjson.JSONDecodeError:
+            continue
 
     raise ValueError("No valid JSON block found in model output.")
 
 # ---------- 3) Optional deterministic 'repair' (no extra LLM call) ----------
+_SMART_QUOTES      = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2019": "'", "\ufeff": None})
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
 def basic_json_repair(s: str) -> Optional[str]:
-    # Common issues: smart quotes, trailing commas, BOM
-    repaired = s.replace("\u201c", '"').replace("\u201d", '"').replace("\u2019", "'")
-    repaired = repaired.replace("\ufeff", "")
+    # Common issues: smart quotes, trailing commas, BOM (quotes + BOM in one translate pass)
+    repaired = s.translate(_SMART_QUOTES)
     # Drop trailing commas before } or ]
-    repaired = re.sub(r",\s*([}\]])", r"\1", repaired)
+    repaired = _TRAILING_COMMA_RE.sub(r"\1", repaired)
     try:
-        json.loads(repaired)
+        orjson.loads(repaired)
         return repaired
     except Exception:
         return None
 
 # ---------- 4) Enforce with Pydantic ----------
-def coerce_and_validate(resp: Any, model: Type[StrictModel]) -> StrictModel:
-    text = responses_text(resp)
-    raw_json = None
+def _validate_first_block(text: str, model: Type[StrictModel]) -> Optional[Tuple[str, StrictModel]]:
+    """
+    Parse + validate the first JSON block that fits `model`, each in one pass with
+    model_validate_json (pydantic-core's Rust parser; no intermediate dict). A block that is JSON
+    but the wrong shape (e.g. a "[2]" in the prose) is a miss, not a verdict: the search goes on.
+    Returns (block, model); None when no block is valid JSON; raises the first schema error when
+    JSON was found but none fit.
+    """
+    first_error: Optional[ValidationError] = None
+    for candidate in _json_candidates(text):
+        try:
+            return candidate, model.model_validate_json(candidate)
+        except ValidationError as e:
+            if first_error is None and any(err["type"] != "json_invalid" for err in e.errors()):
+                first_error = e
+
+    if first_error is not None:
+        # Raise with a clean, actionable message
+        # (paths + reasons help you log and iterate)
+        raise ValueError(f"Pydantic validation failed: {first_error}") from first_error
+    return None
 
+def coerce_and_validate(resp: Any, model: Type[StrictModel]) -> StrictModel:
+    return _coerce_text(responses_text(resp), model)
+
+# Retries / re-runs often return byte-identical text: remember which JSON block validated, per
+# (model, 16-byte digest of the text). A hit skips the candidate scan, failed attempts and repair,
+# and re-validates just that block, so every caller gets its own model instance.
+VALIDATED_CACHE_SIZE = 256
+_validated: "OrderedDict[tuple, str]" = OrderedDict()
+
+def _cache_key(text: str, model: Type[StrictModel]) -> tuple:
+    return model, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+def _remember(key: tuple, block: str) -> None:
+    _validated[key] = block
+    while len(_validated) > VALIDATED_CACHE_SIZE:
+        _validated.popitem(last=False)
+
+def _coerce_text(text: str, model: Type[StrictModel], key: Optional[tuple] = None) -> StrictModel:
+    key   = key or _cache_key(text, model)
+    block = _validated.get(key)
+    if block is not None:
+        _validated.move_to_end(key)
+        return model.model_validate_json(block)
+
+    block, result = _coerce_uncached(text, model)
+    _remember(key, block)
+    return result
+
+def _coerce_uncached(text: str, model: Type[StrictModel]) -> Tuple[str, StrictModel]:
+    # Nested objects (every card's source_span) parse as JSON but not as `model`, so a payload
+    # broken by a trailing comma / smart quotes surfaces a schema error here, not "no JSON"
+    schema_error: Optional[ValueError] = None
     try:
-        block = extract_json_block(text)
-        raw_json = block
-    except ValueError:
+        found = _validate_first_block(text, model)
+    except ValueError as e:
+        found, schema_error = None, e
+
+    if found is None:
         # try naive repair on whole text
         fixed = basic_json_repair(text)
-        if not fixed:
-            raise
-
-        raw_json = extract_json_block(fixed)
-
-    obj = json.loads(raw_json)
-
+        if fixed:
+            try:
+                found = _validate_first_block(fixed, model)
+            except ValueError as e:
+                schema_error = schema_error or e
+
+    if found is None:
+        if schema_error is not None:
+            raise schema_error
+        raise ValueError("No valid JSON block found in model output.")
+    return found
+
+# ---------- 5) Validate many responses (e.g. every chunk's cards before QA) ----------
+# Below this many uncached responses, spawning workers and pickling models back costs more than it saves
+PARALLEL_MIN_RESPONSES = 32
+# Target text per worker task, so the per-task IPC overhead is amortized
+PARALLEL_TASK_CHARS    = 100_000
+
+def coerce_and_validate_many(
+    resps: Iterable[Any], model: Type[StrictModel], max_workers: Optional[int] = None
+) -> List[StrictModel]:
+    """
+    coerce_and_validate over many responses, in input order. Cache hits are served in this
+    process; when enough responses miss, those are spread over a process pool (parse + validate
+    is CPU-bound and holds the GIL between pydantic-core calls) and their winning blocks are
+    cached here. Workers get the plain text, since SDK response objects don't pickle reliably.
+    """
+    texts  = [responses_text(r) for r in resps]
+    keys   = [_cache_key(t, model) for t in texts]
+    misses = [i for i, k in enumerate(keys) if k not in _validated]
+    if len(misses) < PARALLEL_MIN_RESPONSES:
+        return [_coerce_text(t, model, k) for t, k in zip(texts, keys)]
+
+    miss_texts = [texts[i] for i in misses]
+    chunksize  = max(1, PARALLEL_TASK_CHARS * len(miss_texts) // max(1, sum(map(len, miss_texts))))
     try:
-        return model.model_validate(obj)
-    except ValidationError as e:
-        # Raise with a clean, actionable message
-        # (paths + reasons help you log and iterate)
-        raise ValueError(f"Pydantic validation failed: {e}") from e
\ No newline at end of file
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            found = list(ex.map(_coerce_uncached, miss_texts, repeat(model), chunksize=chunksize))
+    except (OSError, NotImplementedError):
+        # No /dev/shm (e.g. AWS Lambda) means no multiprocessing semaphores; validate inline
+        return [_coerce_text(t, model, k) for t, k in zip(texts, keys)]
+
+    results: List[Optional[StrictModel]] = [None] * len(texts)
+    for i, (block, result) in zip(misses, found):
+        _remember(keys[i], block)
+        results[i] = result
+    return [r if r is not None else _coerce_text(texts[i], model, keys[i]) for i, r in enumerate(results)]
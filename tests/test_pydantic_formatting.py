@@ -0,0 +1,36 @@
+import orjson
+
+from pydantic_formatting import CardsPayload, coerce_and_validate
+
+
+class _Resp:
+    def __init__(self, text: str):
+        self.output_text = text
+
+
+_CARD = {
+    "type": "basic",
+    "front": "What is a cell?",
+    "back": "The basic unit of life.",
+    "source_span": {"start": 0, "end": 3},
+    "difficulty": 2,
+}
+_PAYLOAD = orjson.dumps({
+    "stage": "cards",
+    "chunk_index": 0,
+    "batch_index": 0,
+    "cards": [_CARD],
+    "estimated_total_for_chunk": 1,
+}).decode()
+
+
+def test_trailing_comma_payload_is_repaired():
+    text = _PAYLOAD.replace("}]", "},]")  # the LLM's trailing comma after the last card
+    result = coerce_and_validate(_Resp(text), CardsPayload)
+    assert result.cards[0].front == "What is a cell?"
+
+
+def test_smart_quote_payload_is_repaired():
+    text = _PAYLOAD.replace('"stage"', "“stage”")
+    result = coerce_and_validate(_Resp(text), CardsPayload)
+    assert result.stage == "cards"
@@ -1,11 +1,25 @@
 import os
-import json
+import re
+import codecs
+import ijson
+import orjson
 import gzip
+import io
+import uuid
+import hashlib
+import asyncio
 import base64
+import threading
+from binascii import b2a_base64  # what b64encode wraps, minus a Python call layer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 
 # -----------------------------------------------------------------------------
@@ -14,6 +28,22 @@ from botocore.exceptions import BotoCoreError, ClientError
 PARSER_FUNCTION_NAME = os.getenv("DOCFILE_EXTRACTION_FUNCTION", "docfile-extraction")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")  # or None to use default Boto3 chain
 ALLOW_REMOTE = os.getenv("ALLOW_REMOTE_ARTIFACTS", "false").lower() in ("true")
+# Files larger than INLINE_MAX_BYTES go to the parser via S3 instead of base64 in the event
+# (only when an upload bucket is configured; give it a lifecycle rule to expire uploads/).
+UPLOAD_BUCKET = os.getenv("DOCFILE_UPLOAD_BUCKET")
+INLINE_MAX_BYTES = int(os.getenv("DOCFILE_INLINE_MAX_BYTES", str(256 * 1024)))
+# Opt-in: keep recently read s3:// artifacts in memory, revalidated by ETag on each hit
+S3_CACHE = os.getenv("DOCFILE_S3_CACHE", "false").lower() in ("1", "true")
+# Ceiling on decompressed inline_*_b64_gzip artifacts (decompression-bomb guard)
+INLINE_GZIP_MAX_BYTES = int(os.getenv("DOCFILE_INLINE_GZIP_MAX_BYTES", str(64 * 1024 * 1024)))
+# Opt-in: remember the manifests of the last N documents, so a retry / re-upload of identical
+# bytes skips the parser invocation entirely (manifests carry the full text; size accordingly)
+MANIFEST_CACHE_SIZE = int(os.getenv("DOCFILE_MANIFEST_CACHE_SIZE", "0"))
+# Parser invocations kept in flight at once by extract_manifests_from_binaries
+PARSER_MAX_CONCURRENCY = int(os.getenv("DOCFILE_MAX_CONCURRENCY", "8"))
+# Sync invokes block until the parser returns, so the read timeout must cover its whole run
+# (botocore's 60s default would cut a long parse and then retry it as a second invocation)
+PARSER_READ_TIMEOUT = int(os.getenv("DOCFILE_INVOKE_TIMEOUT", "900"))
 
 
 # -----------------------------------------------------------------------------
@@ -44,11 +74,7 @@ def extract_text_from_binary(data: Union[bytes, bytearray, memoryview], filename
 
     artifacts: Dict[str, Any] = docs[0].get("artifacts") or {}
 
-    markdown_text = artifacts['markdown']
-    json_text = artifacts['json']
-    plain_text = artifacts['text']
-
-    return markdown_text
+    return artifacts['markdown']
 
     # 1) Inline-first (no network)
     # inline = _read_inline_artifact(artifacts)
@@ -89,8 +115,75 @@ def extract_manifest_from_binary(data: Union[bytes, bytearray, memoryview], file
     Same as above but returns the full manifest dict:
       { "documents": [ { input_name, artifacts{markdown/json/text/chunks}, status, ... } ] }
     """
-    event = _build_event_from_bytes([(filename, bytes(data))])
-    return _invoke_parser_lambda(PARSER_FUNCTION_NAME, AWS_REGION, event)
+    if not MANIFEST_CACHE_SIZE:
+        payload = _build_payload_single(filename, data)  # bytes-like as-is; no defensive copy
+        return _invoke_parser_lambda(PARSER_FUNCTION_NAME, AWS_REGION, payload)
+
+    # The filename is part of the key: the parser picks its extractor by extension
+    key = (filename, hashlib.blake2b(data, digest_size=16).digest())
+    with _MANIFEST_LOCK:
+        hit = _MANIFEST_CACHE.get(key)
+        if hit is not None:
+            _MANIFEST_CACHE.move_to_end(key)
+            return hit
+
+    manifest = _invoke_parser_lambda(PARSER_FUNCTION_NAME, AWS_REGION, _build_payload_single(filename, data))
+    with _MANIFEST_LOCK:
+        _MANIFEST_CACHE[key] = manifest
+        while len(_MANIFEST_CACHE) > MANIFEST_CACHE_SIZE:
+            _MANIFEST_CACHE.popitem(last=False)
+    return manifest
+
+# (filename, content digest) -> manifest; hits are shared dicts, so treat them as read-only
+_MANIFEST_CACHE: "OrderedDict[Tuple[str, bytes], Dict[str, Any]]" = OrderedDict()
+_MANIFEST_LOCK = threading.Lock()
+
+
+def submit_binary_to_parser(data: Union[bytes, bytearray, memoryview], filename: str = "document") -> None:
+    """
+    Fire-and-forget: queue the file for the parser Lambda (InvocationType="Event") and return
+    as soon as Lambda accepts it, for callers that only need the parser's side effects.
+    """
+    payload = _build_payload_single(filename, data)
+    _invoke_parser_lambda(PARSER_FUNCTION_NAME, AWS_REGION, payload, invocation_type="Event")
+
+
+async def extract_manifests_from_binaries(
+    files: List[Tuple[str, Union[bytes, bytearray, memoryview]]],
+    max_concurrency: Optional[int] = None,
+) -> List[Union[Dict[str, Any], BaseException]]:
+    """
+    [(filename, data)] -> one manifest per file, parsed concurrently: each file is its own
+    parser invocation (boto3 is sync, so each runs in a worker thread), with at most
+    max_concurrency (default DOCFILE_MAX_CONCURRENCY) in flight.
+    Results keep the order of `files`; a failed file yields its exception instead of a manifest.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or PARSER_MAX_CONCURRENCY)
+
+    async def one(filename: str, data: Union[bytes, bytearray, memoryview]) -> Dict[str, Any]:
+        async with semaphore:
+            return await asyncio.to_thread(extract_manifest_from_binary, data, filename)
+
+    return await asyncio.gather(*(one(name, data) for name, data in files), return_exceptions=True)
+
+
+def extract_manifests_parallel(
+    files: List[Tuple[str, Union[bytes, bytearray, memoryview]]],
+    max_workers: Optional[int] = None,
+) -> List[Union[Dict[str, Any], BaseException]]:
+    """
+    Blocking counterpart of extract_manifests_from_binaries for sync callers: one parser
+    invocation per file from a thread pool (the cached boto3 client is thread-safe), so the
+    files are parsed by concurrent Lambda containers instead of serially inside one.
+    Results keep the order of `files`; a failed file yields its exception instead of a manifest.
+    """
+    if not files:
+        return []
+    workers = min(32, len(files), max_workers or PARSER_MAX_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(extract_manifest_from_binary, data, name) for name, data in files]
+        return [f.exception() or f.result() for f in futures]
+
 
 # -----------------------------------------------------------------------------
 # Internal: Lambda invocation + S3/local artifact reading
@@ -105,38 +198,13 @@ def _read_inline_artifact(artifacts: Dict[str, Any]) -> Optional[str]:
       - artifacts.markdown_data_uri / text_data_uri (data: URL)
       - artifacts.chunks: ["...", "..."]  -> joined with double newlines for quick use
     """
-    # 1) Plain inline strings
-    for k in ("inline_markdown", "inline_text", "markdown_inline", "text_inline"):
-        v = artifacts.get(k)
-        if isinstance(v, str) and v:
-            return v
-
-    # 2) data: URIs
-    for k in ("markdown_data_uri", "text_data_uri"):
-        v = artifacts.get(k)
-        if isinstance(v, str) and v.startswith("data:"):
-            parsed = _read_data_uri(v)
-            if parsed is not None:
-                return parsed
-
-    # 3) base64 variants
-    for k in ("inline_markdown_b64", "inline_text_b64"):
-        v = artifacts.get(k)
-        if isinstance(v, str):
-            try:
-                return base64.b64decode(v).decode("utf-8", errors="replace")
-            except Exception:
-                pass
-
-    # 4) base64 gzipped variants
-    for k in ("inline_markdown_b64_gzip", "inline_text_b64_gzip"):
-        v = artifacts.get(k)
+    # 1) plain strings, 2) data: URIs, 3) base64, 4) base64 gzipped -- first decodable one wins
+    for key, read in _INLINE_READERS:
+        v = artifacts.get(key)
         if isinstance(v, str):
-            try:
-                raw = base64.b64decode(v)
-                return gzip.decompress(raw).decode("utf-8", errors="replace")
-            except Exception:
-                pass
+            text = read(v)
+            if text is not None:
+                return text
 
     # 5) chunk arrays (fallback: stitch together)
     chunks = artifacts.get("chunks")
@@ -145,17 +213,60 @@ def _read_inline_artifact(artifacts: Dict[str, Any]) -> Optional[str]:
 
     return None
 
+def _read_plain(v: str) -> Optional[str]:
+    return v or None
+
+def _read_data_uri_artifact(v: str) -> Optional[str]:
+    return _read_data_uri(v) if v.startswith("data:") else None
+
+def _read_b64(v: str) -> Optional[str]:
+    try:
+        return base64.b64decode(v).decode("utf-8", errors="replace")
+    except Exception:
+        return None
+
+def _read_b64_gzip(v: str) -> Optional[str]:
+    try:
+        raw = base64.b64decode(v)
+        return _gunzip_capped(raw, INLINE_GZIP_MAX_BYTES).decode("utf-8", errors="replace")
+    except Exception:
+        return None
+
+# (artifact key, reader) in priority order, walked once by _read_inline_artifact
+_INLINE_READERS = (
+    ("inline_markdown", _read_plain),
+    ("inline_text", _read_plain),
+    ("markdown_inline", _read_plain),
+    ("text_inline", _read_plain),
+    ("markdown_data_uri", _read_data_uri_artifact),
+    ("text_data_uri", _read_data_uri_artifact),
+    ("inline_markdown_b64", _read_b64),
+    ("inline_text_b64", _read_b64),
+    ("inline_markdown_b64_gzip", _read_b64_gzip),
+    ("inline_text_b64_gzip", _read_b64_gzip),
+)
+
+def _gunzip_capped(raw: bytes, max_bytes: int) -> bytes:
+    """gzip.decompress that stops after max_bytes of output (a tiny stream can inflate to GBs)."""
+    with gzip.GzipFile(fileobj=io.BytesIO(raw)) as gz:
+        out = gz.read(max_bytes + 1)
+    if len(out) > max_bytes:
+        raise ValueError(f"gzip artifact inflates past {max_bytes} bytes")
+    return out
+
+_DATA_URI_B64_RE = re.compile(r";base64", re.IGNORECASE)
+
 def _read_data_uri(data_uri: str) -> Optional[str]:
     """
     Parse simple data: URIs, e.g., data:text/plain;base64,SGVsbG8=
     """
     try:
-        # split header and payload
-        if "," not in data_uri:
+        # header ends at the first comma; check it in place (no split / lowercased header copy)
+        comma = data_uri.find(",")
+        if comma < 0:
             return None
-        header, payload = data_uri.split(",", 1)
-        is_b64 = ";base64" in header.lower()
-        if is_b64:
+        payload = data_uri[comma + 1:]
+        if _DATA_URI_B64_RE.search(data_uri, 0, comma):
             return base64.b64decode(payload).decode("utf-8", errors="replace")
         return payload  # URL-decoding is usually not necessary for simple cases
     except Exception:
@@ -163,38 +274,100 @@ def _read_data_uri(data_uri: str) -> Optional[str]:
 
 
 
-def _build_event_from_bytes(files: List[Tuple[str, bytes]]) -> Dict[str, Any]:
+def _build_payload_from_bytes(files: List[Tuple[str, Union[bytes, bytearray, memoryview]]]) -> bytes:
+    """
+    Serialized invoke Payload for _build_event_from_bytes(files). The common single inline file
+    is written straight to bytes: one join, instead of base64 -> quoted fragment -> orjson copy.
+    """
+    if len(files) == 1:
+        return _build_payload_single(*files[0])
+    return orjson.dumps(_build_event_from_bytes(files))
+
+
+def _build_payload_single(name: str, data: Union[bytes, bytearray, memoryview]) -> bytes:
+    """The public single-file helpers' payload, with no [(name, data)] list to build or unpack."""
+    if _goes_to_s3(data):
+        return orjson.dumps(_file_item(name, data))
+    return b"".join((
+        b'{"file_name":', orjson.dumps(name), b',"content_b64":"', b2a_base64(data, newline=False), b'"}',
+    ))
+
+
+def _build_event_from_bytes(files: List[Tuple[str, Union[bytes, bytearray, memoryview]]]) -> Dict[str, Any]:
     """
     [(filename, data_bytes)] → event shape expected by docfile-extraction:
       Single:  {"file_name": "...", "content_b64": "..."}
       Multi:   {"files": [{"file_name": "...", "content_b64": "..."}, ...]}
+    With DOCFILE_UPLOAD_BUCKET set, a file over INLINE_MAX_BYTES is uploaded once and sent as
+      {"file_name": "...", "s3_uri": "s3://bucket/uploads/<id>/<name>"}
+    instead of "content_b64" (no 33% base64 bloat, and no 6 MB sync-invoke payload ceiling).
     """
-    items = [{"file_name": name, "content_b64": base64.b64encode(b).decode("ascii")} for name, b in files]
-    if len(items) == 1:
-        return {"file_name": items[0]["file_name"], "content_b64": items[0]["content_b64"]}
-    return {"files": items}
+    if len(files) == 1:
+        return _file_item(*files[0])
+    return {"files": [_file_item(name, b) for name, b in files]}
+
+
+def _file_item(name: str, data: Union[bytes, bytearray, memoryview]) -> Dict[str, Any]:
+    if _goes_to_s3(data):
+        key = f"uploads/{uuid.uuid4().hex}/{name}"
+        _put_s3_bytes(data, UPLOAD_BUCKET, key)
+        return {"file_name": name, "s3_uri": f"s3://{UPLOAD_BUCKET}/{key}"}
+    return {"file_name": name, "content_b64": _b64_json(data)}
+
+
+def _goes_to_s3(data: Union[bytes, bytearray, memoryview]) -> bool:
+    return bool(UPLOAD_BUCKET) and len(data) > INLINE_MAX_BYTES
+
+
+def _b64_json(data: Union[bytes, bytearray, memoryview]) -> orjson.Fragment:
+    """
+    base64 of data as an already-serialized JSON string: orjson copies it into the payload
+    verbatim, skipping the bytes -> str decode and the escape scan of a multi-MB str.
+    """
+    return orjson.Fragment(b'"' + b2a_base64(data, newline=False) + b'"')
+
+
+def _put_s3_bytes(data: Union[bytes, bytearray, memoryview], bucket: str, key: str) -> None:
+    # botocore's Body validation takes bytes/bytearray/file-likes, not memoryview
+    body = data.tobytes() if isinstance(data, memoryview) else data
+    try:
+        _s3().put_object(Bucket=bucket, Key=key, Body=body)
+    except (BotoCoreError, ClientError) as e:
+        raise RuntimeError(f"S3 upload for parser Lambda failed: {e}") from e
 
 
-def _invoke_parser_lambda(function_name: str, region_name: Optional[str], event: Dict[str, Any]) -> Dict[str, Any]:
+def _invoke_parser_lambda(
+    function_name: str,
+    region_name: Optional[str],
+    payload: bytes,
+    invocation_type: str = "RequestResponse",
+) -> Optional[Dict[str, Any]]:
     """
-    Invoke the parsing Lambda and return the parsed body dict.
+    Invoke the parsing Lambda with a serialized event (see _build_payload_from_bytes) and return
+    the parsed body dict.
     Your handler returns: {"statusCode":200,"body":"{\"documents\":[...]}"}.
+    With invocation_type="Event" the invoke is only queued: there is no body, so returns None.
     """
     try:
-        client = boto3.client("lambda", region_name=region_name)
-        resp = client.invoke(
+        resp = _lambda(region_name).invoke(
             FunctionName=function_name,
-            InvocationType="RequestResponse",  # sync
-            Payload=json.dumps(event).encode("utf-8"),
+            InvocationType=invocation_type,  # "RequestResponse" = sync
+            Payload=payload,
         )
 
-        payload_text = resp["Payload"].read().decode("utf-8", "replace")
-        if "FunctionError" in resp:
-            raise RuntimeError(f"Parser Lambda FunctionError={resp['FunctionError']}: {payload_text}")
+        # Release the response stream (and its pooled connection) as soon as it has been read
+        with closing(resp["Payload"]) as stream:
+            if invocation_type == "Event":
+                return None
 
-        outer = json.loads(payload_text) if payload_text else {}
-        body = outer.get("body")
-        body_obj = json.loads(body) if isinstance(body, str) else body
+            if "FunctionError" in resp:
+                payload_text = stream.read().decode("utf-8", "replace")
+                raise RuntimeError(f"Parser Lambda FunctionError={resp['FunctionError']}: {payload_text}")
+
+            # Stream just the "body" member out of the envelope instead of reading + parsing it whole
+            body = next(ijson.items(stream, "body", use_float=True), None)
+
+        body_obj = orjson.loads(body) if isinstance(body, str) else body
 
         if not isinstance(body_obj, dict) or "documents" not in body_obj:
             raise RuntimeError(f"Unexpected parser Lambda response body: {body}")
@@ -203,7 +376,7 @@ def _invoke_parser_lambda(function_name: str, region_name: Optional[str], event:
 
     except (BotoCoreError, ClientError) as e:
         raise RuntimeError(f"AWS invoke failed: {e}") from e
-    except json.JSONDecodeError as e:
+    except (orjson.JSONDecodeError, ijson.JSONError) as e:
         raise RuntimeError(f"Failed to decode parser Lambda response JSON: {e}") from e
 
 
@@ -226,28 +399,118 @@ def _read_artifact(uri_or_path: str) -> Optional[str]:
     return None
 
 def _http_read_text(url: str) -> Optional[str]:
-    # stdlib only to avoid extra deps
-    import urllib.request
     try:
-        with urllib.request.urlopen(url, timeout=30) as resp:
-            charset = resp.headers.get_content_charset() or "utf-8"
-            return resp.read().decode(charset, errors="replace")
+        resp = _http().request("GET", url, preload_content=False)
+        try:
+            if resp.status >= 400:
+                return None
+            charset = _content_charset(resp.headers.get("Content-Type")) or "utf-8"
+            return _decode_chunks(resp.stream(HTTP_READ_CHUNK), charset)
+        finally:
+            resp.release_conn()  # back to the pool for the next artifact fetch
     except Exception:
         return None
+
+HTTP_READ_CHUNK = 32 * 1024
+
+def _content_charset(content_type: Optional[str]) -> Optional[str]:
+    """'text/markdown; charset=UTF-8' -> 'utf-8'"""
+    for param in (content_type or "").split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            return value.strip().strip('"').lower() or None
+    return None
     
 def _s3_read_text(s3_uri: str) -> Optional[str]:
     """
-    s3://bucket/key -> text (only if ALLOW_REMOTE_ARTIFACTS=1 and boto3 installed).
+    s3://bucket/key -> text (only if ALLOW_REMOTE_ARTIFACTS=1).
+    With DOCFILE_S3_CACHE=1, repeat reads of an unchanged object are served from memory.
     """
-    try:
-        import boto3  # local import to avoid hard dep when not used
-    except Exception:
-        raise RuntimeError("boto3 not installed, and S3 access was requested.")
-
     bucket, key = _split_s3_uri(s3_uri)
-    client = boto3.client("s3")
-    obj = client.get_object(Bucket=bucket, Key=key)
-    return obj["Body"].read().decode("utf-8", errors="replace")
+    if not S3_CACHE:
+        obj = _s3().get_object(Bucket=bucket, Key=key)
+        with closing(obj["Body"]) as body:
+            return _decode_chunks(body.iter_chunks(S3_READ_CHUNK))
+
+    # HEAD is a cheap round-trip; a changed object gets a new ETag and so a fresh GET
+    etag = _s3().head_object(Bucket=bucket, Key=key)["ETag"]
+    return _s3_read_text_cached(bucket, key, etag)
+
+@lru_cache(maxsize=64)
+def _s3_read_text_cached(bucket: str, key: str, etag: str) -> str:
+    obj = _s3().get_object(Bucket=bucket, Key=key, IfMatch=etag)
+    with closing(obj["Body"]) as body:
+        return _decode_chunks(body.iter_chunks(S3_READ_CHUNK))
+
+S3_READ_CHUNK = 1024 * 1024  # big enough that per-chunk overhead vanishes; still bounded
+
+def _decode_chunks(chunks: Iterable[bytes], encoding: str = "utf-8") -> str:
+    """
+    Streamed body -> text, decoded chunk by chunk: peak memory is one chunk plus the decoded
+    parts instead of the whole raw object alongside its decoded copy.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parts = [decoder.decode(chunk) for chunk in chunks]
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
+
+_SESSION = None
+_S3_CLIENT = None
+_HTTP_POOL = None
+_LAMBDA_CLIENTS: Dict[Optional[str], Any] = {}
+# Clients are thread-safe once built, but building them off a shared session is not, and
+# extract_manifests_from_binaries makes its first calls from several worker threads at once
+_CLIENT_LOCK = threading.RLock()
+
+# Keep-alive holds the pooled connections open between warm invocations; the pool is sized
+# to the parser fan-out so concurrent calls don't discard connections when they return
+_CLIENT_CONFIG = Config(
+    tcp_keepalive=True,
+    connect_timeout=3,
+    retries={"max_attempts": 2, "mode": "standard"},
+    max_pool_connections=max(10, PARSER_MAX_CONCURRENCY),
+)
+_LAMBDA_CONFIG = _CLIENT_CONFIG.merge(Config(read_timeout=PARSER_READ_TIMEOUT))
+
+def _session():
+    """One boto3 Session per process: credentials are resolved once and shared by every client."""
+    global _SESSION
+    if _SESSION is None:
+        with _CLIENT_LOCK:
+            if _SESSION is None:
+                _SESSION = boto3.Session()
+    return _SESSION
+
+def _s3():
+    """One S3 client per process (client construction loads the service model)."""
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        with _CLIENT_LOCK:
+            if _S3_CLIENT is None:
+                _S3_CLIENT = _session().client("s3", config=_CLIENT_CONFIG)
+    return _S3_CLIENT
+
+def _http():
+    """One keep-alive pool for http(s) artifact URLs (urllib3 ships with botocore), e.g. presigned S3."""
+    global _HTTP_POOL
+    if _HTTP_POOL is None:
+        with _CLIENT_LOCK:
+            if _HTTP_POOL is None:
+                import urllib3
+                _HTTP_POOL = urllib3.PoolManager(maxsize=8, retries=urllib3.Retry(2), timeout=30.0)
+    return _HTTP_POOL
+
+def _lambda(region_name: Optional[str]):
+    """One Lambda client per region per process; warm invocations reuse its connection pool."""
+    client = _LAMBDA_CLIENTS.get(region_name)
+    if client is None:
+        with _CLIENT_LOCK:
+            client = _LAMBDA_CLIENTS.get(region_name)
+            if client is None:
+                client = _LAMBDA_CLIENTS[region_name] = _session().client(
+                    "lambda", region_name=region_name or None, config=_LAMBDA_CONFIG
+                )
+    return client
 
 def _split_s3_uri(s3_uri: str) -> tuple[str, str]:
     assert s3_uri.startswith("s3://")